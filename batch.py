@@ -0,0 +1,274 @@
+import sys
+
+import numpy as np
+
+import main
+
+#Vectorized simulator for AIs whose decisions only depend on their hand
+#total and the dealer's upcard (PlayerAIStand and PlayerAIRules).
+#
+#Instead of playing one round at a time, the batch simulator keeps many
+#independent shoes ("lanes") side by side and plays one round in every lane
+#at once using NumPy arrays. Each lane behaves exactly like its own
+#BlackjackSimulator with the default house rules (see main.HouseRules; the
+#others aren't supported): same payouts, same reshuffle point.
+#
+#Run `python batch.py --check` to compare it against the scalar simulator.
+
+SUPPORTED_AIS = (main.PlayerAIStand, main.PlayerAIRules)
+
+# Card values by card index, with Aces as 11 like Card.base_value.
+CARD_VALUES = np.frombuffer(main.BASE_VALUES, dtype=np.uint8).astype(np.int16)
+
+def strategy_table(ai_type):
+    # Asks the AI for its choice in every (hard total, upcard) situation.
+    # Entries that can't come up are left as stand.
+    table = np.full((32, 12), main.PlayerAI.CH_STAND, dtype=np.int8)
+
+    player_ai = ai_type()
+    for upcard in range(2, 12):
+        player_ai.dealer_hand = main.Hand("Dealer", main.card_with_value(upcard))
+        for total in range(4, 21):
+            first = min(10, total - 2)
+            hand = main.Hand("Player",
+                main.card_with_value(first), main.card_with_value(total - first))
+            table[total, upcard] = player_ai.choice(hand)
+
+    if not np.isin(table, (main.PlayerAI.CH_HIT, main.PlayerAI.CH_STAND,
+            main.PlayerAI.CH_DOUBLE_DOWN)).all():
+        raise ValueError(f"{ai_type.__name__} splits, which the batch simulator can't do")
+    return table
+
+def add_cards(total, soft, values):
+    # Hand.add_card, for arrays of hands.
+    total = total + values
+    ace = values == 11
+    total = np.where(ace & soft, total - 10, total)
+    soft = soft | ace
+    reduce = soft & (total > 21)
+    total = np.where(reduce, total - 10, total)
+    soft = soft & ~reduce
+    return total, soft
+
+class BatchSimulator:
+    def __init__(self, ai_type, num_decks=1, shuffle_deck_at=0.5,
+            lanes=4096, seed=None, record_shoes=False, rules=None):
+        if ai_type not in SUPPORTED_AIS:
+            raise ValueError(f"{ai_type.__name__} can't be simulated in batch")
+        if rules is not None and rules != main.HouseRules():
+            raise ValueError("the batch simulator only plays the default house rules")
+
+        self.table = strategy_table(ai_type)
+        self.bet = ai_type().make_bet()
+
+        self.num_decks = num_decks
+        self.shuffle_deck_at = shuffle_deck_at
+        self.size = 52 * num_decks
+        self.lanes = lanes
+
+        self.unshuffled = np.repeat(np.arange(52, dtype=np.uint8), num_decks)
+        self.rngs = [np.random.default_rng(s)
+            for s in np.random.SeedSequence(seed).spawn(lanes)]
+
+        # Every shoe dealt in each lane, so they can be replayed later.
+        self.recorded = [[] for _ in range(lanes)] if record_shoes else None
+
+        self.values = np.empty((lanes, self.size), dtype=np.int16)
+        self.dealt = np.zeros(lanes, dtype=np.int64)
+        for lane in range(lanes):
+            self.shuffle(lane)
+
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        self.funds = 0
+
+    def shuffle(self, lane):
+        order = self.rngs[lane].permutation(self.unshuffled)
+        if self.recorded is not None:
+            self.recorded[lane].append(order.tobytes())
+        self.values[lane] = CARD_VALUES[order]
+        self.dealt[lane] = 0
+
+    def run(self, num_rounds):
+        lane_rounds = np.array([
+            num_rounds // self.lanes + (lane < num_rounds % self.lanes)
+            for lane in range(self.lanes)])
+
+        for round_number in range(lane_rounds.max()):
+            self.play_round(np.nonzero(lane_rounds > round_number)[0])
+
+    def play_round(self, lanes):
+
+        remaining = self.size - self.dealt[lanes]
+        for lane in lanes[remaining < self.size * self.shuffle_deck_at]:
+            self.shuffle(lane)
+
+        values = self.values
+        dealt = self.dealt[lanes]
+        n = len(lanes)
+
+        def deal(mask):
+            # Deals a card to the masked hands, returns 0 for the others.
+            cards = np.zeros(n, dtype=np.int16)
+            cards[mask] = values[lanes[mask], dealt[mask]]
+            dealt[mask] += 1
+            return cards
+
+        everyone = np.ones(n, dtype=bool)
+        no_hand = np.zeros(n, dtype=np.int16), np.zeros(n, dtype=bool)
+
+        #Deal 2 cards to the player and dealer, alternating
+        player = add_cards(*no_hand, deal(everyone))
+        upcard = deal(everyone)
+        dealer = add_cards(*no_hand, upcard)
+        player = add_cards(*player, deal(everyone))
+        dealer = add_cards(*dealer, deal(everyone))
+
+        bet = np.full(n, self.bet)
+        net = np.zeros(n, dtype=np.result_type(bet, np.int64))
+
+        player_blackjack = player[0] == 21
+        dealer_blackjack = dealer[0] == 21
+
+        net[player_blackjack & ~dealer_blackjack] = self.bet * 3 // 2
+        net[dealer_blackjack & ~player_blackjack] = -self.bet
+
+        #Players play out their hands.
+        playing = ~player_blackjack & ~dealer_blackjack
+        live = playing.copy()
+        while playing.any():
+            decision = self.table[np.minimum(player[0], 31), upcard]
+            playing &= decision != main.PlayerAI.CH_STAND
+
+            double = playing & (decision == main.PlayerAI.CH_DOUBLE_DOWN)
+            bet[double] *= 2
+
+            player = add_cards(*player, deal(playing))
+            playing &= ~double & (player[0] < 21)
+
+        busted = live & (player[0] > 21)
+        net[busted] = -bet[busted]
+        live &= ~busted
+
+        #Dealer hits when below 17 and stands when above 16.
+        drawing = live & (dealer[0] < 17)
+        while drawing.any():
+            dealer = add_cards(*dealer, deal(drawing))
+            drawing &= dealer[0] < 17
+
+        won = live & ((dealer[0] > 21) | (player[0] > dealer[0]))
+        lost = live & (dealer[0] <= 21) & (player[0] < dealer[0])
+        net[won] = bet[won]
+        net[lost] = -bet[lost]
+
+        self.dealt[lanes] = dealt
+
+        self.wins += int(np.count_nonzero(net > 0))
+        self.losses += int(np.count_nonzero(net < 0))
+        self.draws += int(np.count_nonzero(net == 0))
+        self.funds += net.sum().item()
+
+class RecordedShoe(main.Shoe):
+    # A shoe whose shuffles are a recorded sequence of orders, one per
+    # shuffle, starting with the simulator's first. Unlike main.ReplayShoe,
+    # which deals another shoe's current order again, every shuffle moves
+    # on to the next order.
+
+    def __init__(self, num_decks, orders):
+        super().__init__(num_decks)
+        self.orders = iter(orders)
+
+    def shuffle(self):
+        self.order = bytearray(next(self.orders))
+        self.dealt = 0
+
+def cross_check(ai_type, num_rounds, num_decks=1, shuffle_deck_at=0.5,
+        lanes=64, seed=0):
+    # Plays the same shoes in batch and with one BlackjackSimulator per
+    # lane. Returns both sets of (wins, losses, draws, funds).
+    batch = BatchSimulator(ai_type, num_decks=num_decks,
+        shuffle_deck_at=shuffle_deck_at, lanes=lanes, seed=seed,
+        record_shoes=True)
+    batch.run(num_rounds)
+
+    totals = [0, 0, 0, 0]
+    for lane in range(lanes):
+        player_ai = ai_type()
+        sim = main.BlackjackSimulator(player_ai,
+            num_decks=num_decks, shuffle_deck_at=shuffle_deck_at, quiet=True,
+            shoe=RecordedShoe(num_decks, batch.recorded[lane]))
+
+        for _ in range(num_rounds // lanes + (lane < num_rounds % lanes)):
+            sim.play_run()
+
+        totals[0] += player_ai.wins
+        totals[1] += player_ai.losses
+        totals[2] += player_ai.draws
+        totals[3] += player_ai.funds
+
+    return (batch.wins, batch.losses, batch.draws, batch.funds), tuple(totals)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+
+    ai_type_group = parser.add_mutually_exclusive_group()
+    ai_type_group.add_argument("-s", "--stand",
+        help="use an AI that always stands",
+        dest="ai_type", action="store_const", const=main.PlayerAIStand)
+    ai_type_group.add_argument("-r", "--rules",
+        help="use an AI that follows a set of rules (default)",
+        dest="ai_type", action="store_const", const=main.PlayerAIRules)
+    parser.set_defaults(ai_type=main.PlayerAIRules)
+
+    parser.add_argument("-n", "--num-rounds",
+        help="set the number of rounds to play (default 1000000)",
+        dest="num_rounds", metavar="NUM",
+        type=int, default=1000000)
+    parser.add_argument("-d", "--num-decks",
+        help="set the number of decks to play with (default 1)",
+        dest="num_decks", metavar="NUM",
+        type=int, default=1)
+    parser.add_argument("-sh", "--shuffle-at",
+        help="sets the fraction of the cards that are dealt before shuffling (default 0.5)",
+        dest="shuffle_at", metavar="FRAC",
+        type=float, default=0.5)
+    parser.add_argument("--lanes",
+        help="set the number of shoes played side by side (default 4096)",
+        metavar="NUM", type=int, default=4096)
+    parser.add_argument("--seed",
+        help="seed the shuffles (default 0 with --check, so the check can be repeated)",
+        type=int)
+    parser.add_argument("--check",
+        help="compare the results against the scalar simulator on the same shoes",
+        action="store_true")
+    args = parser.parse_args()
+
+    if args.check:
+        batch_result, scalar_result = cross_check(args.ai_type,
+            min(args.num_rounds, 100000),
+            num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+            seed=args.seed if args.seed is not None else 0)
+        print("Batch: ", batch_result)
+        print("Scalar:", scalar_result)
+        if batch_result != scalar_result:
+            sys.exit("Results differ!")
+        print("Results match.")
+    else:
+        sim = BatchSimulator(args.ai_type,
+            num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+            lanes=args.lanes, seed=args.seed)
+
+        start = time.perf_counter()
+        sim.run(args.num_rounds)
+        elapsed = time.perf_counter() - start
+
+        print("Player Wins:  ", sim.wins)
+        print("Player Losses:", sim.losses)
+        print("Player Draws: ", sim.draws)
+        print(f"Profit:        {sim.funds:+}")
+        print(f"({args.num_rounds / elapsed:.0f} rounds/s)")
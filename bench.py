@@ -0,0 +1,136 @@
+import json
+import os
+import platform
+import time
+
+import main
+
+#Measures how fast the simulator plays rounds.
+#Run it with `python bench.py`, see `python bench.py --help` for options.
+#
+#For each AI, number of decks and shuffle point, the suite plays a number of
+#headless rounds to measure rounds/sec, then plays them again with timers
+#around each phase of a round:
+#   deal     dealing cards (BlackjackSimulator.deal)
+#   choice   the AI's play decisions (PlayerAI.choice)
+#   dealer   playing out the dealer's hand (BlackjackSimulator.resolve_dealer)
+#   settle   paying out the hands (BlackjackSimulator.settle)
+#Phase times are exclusive: time spent dealing the player's cards counts as
+#dealing, not as choices. The dealer's draws are dealt by the dealer
+#resolution itself, so they count as dealer time. The timers (see main.Profiler) slow
+#things down, which is why rounds/sec is measured separately.
+
+# Phase names, and the names the simulator's profiler uses for them.
+PHASES = {
+    "deal": "deal",
+    "choice": "ai.choice",
+    "dealer": "resolve_dealer",
+    "settle": "settle",
+}
+
+def make_sim(ai_type, log_file=None, **sim_kwargs):
+    return main.BlackjackSimulator(ai_type(),
+        quiet=True, log_file=log_file, rng=0, **sim_kwargs)
+
+def rounds_per_second(ai_type, num_rounds, log_file=None, **sim_kwargs):
+    sim = make_sim(ai_type, log_file=log_file, **sim_kwargs)
+
+    start = time.perf_counter()
+    for _ in range(num_rounds):
+        sim.play_run()
+    return num_rounds / (time.perf_counter() - start)
+
+def phase_times(ai_type, num_rounds, **sim_kwargs):
+    sim = make_sim(ai_type, **sim_kwargs)
+    profiler = sim.enable_profiling()
+
+    for _ in range(num_rounds):
+        sim.play_run()
+
+    return {
+        phase: {
+            "calls": profiler.calls[name],
+            "seconds": profiler.exclusive[name],
+            "us_per_round": profiler.exclusive[name] / num_rounds * 1e6,
+        }
+        for phase, name in PHASES.items()}
+
+def bench_headless(ai_type, num_rounds, **sim_kwargs):
+    # A log file counts as a sink, so the rendered run builds all of the
+    # output and throws it away. The headless run builds none of it.
+    with open(os.devnull, "w", encoding="utf-8") as sink:
+        rendered = rounds_per_second(ai_type, num_rounds,
+            log_file=sink, **sim_kwargs)
+    headless = rounds_per_second(ai_type, num_rounds, **sim_kwargs)
+    return rendered, headless
+
+def run_suite(ai_names, deck_counts, shuffle_points, num_rounds):
+    results = []
+    for name in ai_names:
+        for num_decks in deck_counts:
+            for shuffle_at in shuffle_points:
+                sim_kwargs = {"num_decks": num_decks, "shuffle_deck_at": shuffle_at}
+                ai_type = main.AI_TYPES[name]
+                results.append({
+                    "ai": name,
+                    "num_decks": num_decks,
+                    "shuffle_at": shuffle_at,
+                    "rounds": num_rounds,
+                    "rounds_per_sec": rounds_per_second(ai_type, num_rounds, **sim_kwargs),
+                    "phases": phase_times(ai_type, num_rounds, **sim_kwargs),
+                })
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num-rounds",
+        help="set the number of rounds per measurement (default 20000)",
+        dest="num_rounds", metavar="NUM",
+        type=int, default=20000)
+    parser.add_argument("--ais", metavar="AI", nargs="+",
+        help=f"the AIs to measure (default all): {', '.join(main.AI_TYPES)}",
+        choices=main.AI_TYPES, default=list(main.AI_TYPES))
+    parser.add_argument("-d", "--num-decks",
+        help="the numbers of decks to play with (default 1 6 8)",
+        dest="deck_counts", metavar="NUM", nargs="+",
+        type=int, default=[1, 6, 8])
+    parser.add_argument("-sh", "--shuffle-at",
+        help="the fractions of the cards dealt before shuffling (default 0.25 0.5)",
+        dest="shuffle_points", metavar="FRAC", nargs="+",
+        type=float, default=[0.25, 0.5])
+    parser.add_argument("--json", metavar="FILE",
+        help="save the results to FILE as JSON")
+    parser.add_argument("--headless",
+        help="instead, compare headless runs against runs that render everything",
+        action="store_true")
+    args = parser.parse_args()
+
+    if args.headless:
+        print(f"{'AI':20} {'rendered':>12} {'headless':>12} {'speedup':>8}")
+        for name in args.ais:
+            rendered, headless = bench_headless(main.AI_TYPES[name],
+                args.num_rounds, num_decks=args.deck_counts[0])
+            print(f"{name:20} {rendered:>10.0f}/s {headless:>10.0f}/s"
+                f" {headless / rendered:>7.2f}x")
+    else:
+        results = run_suite(args.ais, args.deck_counts, args.shuffle_points,
+            args.num_rounds)
+
+        print(f"{'AI':20} {'decks':>5} {'shuffle':>7} {'rounds/s':>10}",
+            *(f"{phase + ' us':>10}" for phase in PHASES))
+        for r in results:
+            print(f"{r['ai']:20} {r['num_decks']:>5} {r['shuffle_at']:>7} "
+                f"{r['rounds_per_sec']:>10.0f}",
+                *(f"{r['phases'][phase]['us_per_round']:>10.2f}" for phase in PHASES))
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                }, f, indent=2)
@@ -0,0 +1,416 @@
+import functools
+import types
+
+import main
+
+#Expected values computed by going through every possible sequence of cards
+#instead of simulating rounds.
+#
+#A shoe is described by its composition: a tuple with the number of cards
+#left of each value, in the order of VALUES (Aces first, 10-value cards
+#last). The probabilities for the dealer's final total are memoized on the
+#composition, so positions that are reached through different orders of the
+#same cards are only worked out once.
+#
+#The house rules are the ones BlackjackSimulator plays by, RULES (see
+#main.HouseRules and set_rules). With the defaults:
+#- The dealer stands on all 17s.
+#- The dealer checks for blackjack, so the player only plays against dealer
+#  hands that aren't blackjack.
+#- Blackjack pays 3 to 2, surrender gives back half the bet.
+#- A hand may only be split once, doubling down is allowed after a split,
+#  and a 21 made after a split is not a blackjack.
+#- Insurance is a side bet of a fixed 5, whatever the bet, paying 2 to 1.
+#Resplitting (max_splits above 1) isn't handled.
+#
+#EVs are per unit of the original bet. Split hands are valued as two
+#independent hands drawn from the same composition.
+#
+#They aren't quite exact. The dealer's final total is worked out given that
+#the dealer doesn't have blackjack, but the player's cards are still drawn
+#from the whole composition, as if the hole card could be anything: a ten
+#under an Ace or an Ace under a ten is never ruled out of the player's draws.
+#This is the usual approximation. Conditioning on the hole card would mean
+#valuing every decision once per possible hole card.
+
+VALUES = (11, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+ACE = 0
+TEN = 9
+
+DEALER_STANDS_AT = 17
+SURRENDER_LOSS = 0.5
+
+RULES = main.HouseRules()
+
+# Index of each outcome in a dealer distribution.
+DEALER_TOTALS = (17, 18, 19, 20, 21)
+DEALER_BUST = 5
+
+def set_rules(rules):
+    # Works out EVs under rules (a HouseRules) from now on. The memoized
+    # EVs, which depend on the rules, are thrown away.
+    global RULES
+    if rules.max_splits != 1:
+        raise ValueError("only max_splits=1 is supported")
+    RULES = rules
+    for memoized in (dealer_outcomes, dealer_distribution, stand_ev, hit_ev,
+            double_ev, split_ev):
+        memoized.cache_clear()
+
+def blackjack_payout():
+    pays, per = RULES.blackjack_pays
+    return pays / per
+
+def full_shoe(num_decks=1):
+    return (4 * num_decks,) * 9 + (16 * num_decks,)
+
+def remove(counts, index):
+    return counts[:index] + (counts[index] - 1,) + counts[index + 1:]
+
+def value_index(card):
+    return VALUES.index(card.base_value)
+
+def add_value(total, soft, value):
+    # Hand.add_card, on a (total, soft) state.
+    total += value
+    if value == 11:
+        if soft:
+            total -= 10
+        soft = True
+    if total > 21 and soft:
+        total -= 10
+        soft = False
+    return total, soft
+
+def draws(counts):
+    # Yields (probability, index, remaining counts) for the next card.
+    n = sum(counts)
+    for i, c in enumerate(counts):
+        if c:
+            yield c / n, i, remove(counts, i)
+
+@functools.lru_cache(maxsize=None)
+def dealer_outcomes(counts, total, soft):
+    # Probabilities of the dealer ending on 17..21 or busting, drawing from
+    # counts with the given hand.
+    if total >= DEALER_STANDS_AT and not (
+            total == DEALER_STANDS_AT and soft and RULES.hit_soft_17):
+        result = [0.0] * 6
+        result[DEALER_BUST if total > 21 else total - 17] = 1.0
+        return tuple(result)
+
+    result = [0.0] * 6
+    for p, i, rest in draws(counts):
+        for k, q in enumerate(dealer_outcomes(rest, *add_value(total, soft, VALUES[i]))):
+            result[k] += p * q
+    return tuple(result)
+
+@functools.lru_cache(maxsize=None)
+def dealer_distribution(counts, upcard):
+    # Like dealer_outcomes, starting from the upcard (an index into VALUES)
+    # and given that the dealer doesn't have blackjack.
+    start = add_value(0, False, VALUES[upcard])
+
+    result = [0.0] * 6
+    weight = 0.0
+    for p, i, rest in draws(counts):
+        total, soft = add_value(*start, VALUES[i])
+        if total == 21:
+            continue
+        weight += p
+        for k, q in enumerate(dealer_outcomes(rest, total, soft)):
+            result[k] += p * q
+    return tuple(q / weight for q in result)
+
+def dealer_blackjack_chance(counts, upcard):
+    if upcard == ACE:
+        return counts[TEN] / sum(counts)
+    if upcard == TEN:
+        return counts[ACE] / sum(counts)
+    return 0.0
+
+@functools.lru_cache(maxsize=None)
+def stand_ev(counts, total, upcard):
+    if total > 21:
+        return -1.0
+    outcomes = dealer_distribution(counts, upcard)
+    ev = outcomes[DEALER_BUST]
+    for dealer_total, p in zip(DEALER_TOTALS, outcomes):
+        if total > dealer_total:
+            ev += p
+        elif total < dealer_total:
+            ev -= p
+    return ev
+
+@functools.lru_cache(maxsize=None)
+def hit_ev(counts, total, soft, upcard):
+    # Take a card, then keep playing as well as possible (hit or stand).
+    ev = 0.0
+    for p, i, rest in draws(counts):
+        new_total, new_soft = add_value(total, soft, VALUES[i])
+        if new_total > 21:
+            ev -= p
+        elif new_total == 21:
+            ev += p * stand_ev(rest, new_total, upcard)
+        else:
+            ev += p * max(
+                stand_ev(rest, new_total, upcard),
+                hit_ev(rest, new_total, new_soft, upcard))
+    return ev
+
+@functools.lru_cache(maxsize=None)
+def double_ev(counts, total, soft, upcard):
+    ev = 0.0
+    for p, i, rest in draws(counts):
+        new_total, _ = add_value(total, soft, VALUES[i])
+        ev += p * stand_ev(rest, new_total, upcard)
+    return 2 * ev
+
+@functools.lru_cache(maxsize=None)
+def split_ev(counts, pair, upcard):
+    # Each hand gets one more card and is then played as well as possible,
+    # including doubling down if the rules allow it, but without splitting
+    # again.
+    ev = 0.0
+    for p, i, rest in draws(counts):
+        total, soft = add_value(*add_value(0, False, VALUES[pair]), VALUES[i])
+        if total == 21:
+            ev += p * stand_ev(rest, total, upcard)
+        else:
+            ev += p * max(
+                stand_ev(rest, total, upcard),
+                hit_ev(rest, total, soft, upcard),
+                double_ev(rest, total, soft, upcard)
+                    if RULES.double_after_split else -2.0)
+    return 2 * ev
+
+def hand_evs(hand, upcard, counts=None, num_decks=1):
+    # The EV of each choice for a Hand against a dealer upcard (a Card),
+    # given that the dealer doesn't have blackjack. counts is the rest of
+    # the shoe; by default, a full shoe minus the visible cards.
+    if counts is None:
+        counts = full_shoe(num_decks)
+        for card in (*hand, upcard):
+            counts = remove(counts, value_index(card))
+    up = value_index(upcard)
+
+    evs = {
+        main.PlayerAI.CH_STAND: stand_ev(counts, hand.total, up),
+        main.PlayerAI.CH_HIT: hit_ev(counts, hand.total, hand.soft, up),
+        main.PlayerAI.CH_DOUBLE_DOWN: double_ev(counts, hand.total, hand.soft, up),
+    }
+    if hand.can_be_split():
+        evs[main.PlayerAI.CH_SPLIT] = split_ev(counts, value_index(hand[0]), up)
+    return evs
+
+class StrategyEvaluator:
+    # Works out the EV of a round for a PlayerAI, asking it for its
+    # choices the same way BlackjackSimulator does. Bets are ignored: the
+    # result is per unit bet.
+    #
+    # Counting AIs are given the running count of the cards missing from
+    # the shoe in their own counting system, so they play and bet as they
+    # would when that composition is reached. The AI's bet only matters
+    # for insurance, which is a fixed amount (RULES.insurance_bet).
+
+    def __init__(self, ai_type, counts):
+        self.counts = counts
+        self.player_ai = ai_type()
+
+        num_decks = round(sum(full_shoe_for(counts)) / 52)
+        removed = [f - c for f, c in zip(full_shoe(num_decks), counts)]
+        self.player_ai.deck_shuffled(types.SimpleNamespace(
+            num_decks=num_decks, dealt=sum(removed)))
+        if hasattr(self.player_ai, "running_count"):
+            system = self.player_ai.counting_system
+            self.player_ai.running_count = system.initial_count(num_decks) + sum(
+                n * system.values[main.card_with_value(v).index]
+                for n, v in zip(removed, VALUES))
+            self.player_ai.update_true_count()
+
+        # The insurance bet per unit of the AI's bet.
+        self.insurance_stake = RULES.insurance_bet / self.player_ai.make_bet()
+
+        self.memo = {}
+
+    def play_ev(self, counts, hand, upcard):
+        if hand.total > 21:
+            return -1.0
+        if hand.total == 21:
+            return stand_ev(counts, 21, upcard)
+
+        if hand.can_be_split():
+            kind = (main.StrategyTable.PAIR, hand[0].base_value)
+        else:
+            kind = (hand.soft, hand.total)
+        key = (counts, kind, hand.times_split, upcard)
+        if key in self.memo:
+            return self.memo[key]
+
+        choice = self.player_ai.choice(hand)
+        if (choice == main.PlayerAI.CH_DOUBLE_DOWN and hand.times_split
+                and not RULES.double_after_split):
+            choice = main.PlayerAI.CH_HIT
+        if choice == main.PlayerAI.CH_STAND:
+            ev = stand_ev(counts, hand.total, upcard)
+        elif choice == main.PlayerAI.CH_DOUBLE_DOWN:
+            ev = double_ev(counts, hand.total, hand.soft, upcard)
+        elif choice == main.PlayerAI.CH_SPLIT:
+            ev = 0.0
+            for p, i, rest in draws(counts):
+                split = main.Hand("Player", hand[0], card_of(i), times_split=1)
+                ev += p * self.play_ev(rest, split, upcard)
+            ev *= 2
+        else:
+            ev = 0.0
+            for p, i, rest in draws(counts):
+                hit = main.Hand("Player", *hand, card_of(i),
+                    times_split=hand.times_split)
+                ev += p * self.play_ev(rest, hit, upcard)
+
+        self.memo[key] = ev
+        return ev
+
+    def round_ev(self):
+        ai = self.player_ai
+        ev = 0.0
+
+        #Player, dealer, player. The hole card is drawn inside the dealer
+        #distributions.
+        for p1, i, after1 in draws(self.counts):
+            for p2, up, after2 in draws(after1):
+                for p3, j, counts in draws(after2):
+                    p = p1 * p2 * p3
+                    hand = main.Hand("Player", card_of(i), card_of(j))
+                    ai.dealer_hand = main.Hand("Dealer", card_of(up))
+                    ev += p * self.hand_ev(counts, hand, up)
+        return ev
+
+    def hand_ev(self, counts, hand, up):
+        ai = self.player_ai
+        dealer_blackjack = dealer_blackjack_chance(counts, up)
+
+        ev = 0.0
+        if up == ACE and ai.choose_insurance() and RULES.insurance_bet:
+            ev += self.insurance_stake * (2 * dealer_blackjack - (1 - dealer_blackjack))
+
+        if hand.total == 21:
+            return ev + (1 - dealer_blackjack) * blackjack_payout()
+        ev -= dealer_blackjack
+
+        ai.my_hands = [hand]
+        surrender = ai.choose_surrender() and RULES.surrender
+        ai.my_hands = ()
+        if surrender:
+            return ev - (1 - dealer_blackjack) * SURRENDER_LOSS
+        return ev + (1 - dealer_blackjack) * self.play_ev(counts, hand, up)
+
+def full_shoe_for(counts):
+    # The smallest full shoe that counts could have come from.
+    num_decks = max(1, -(-counts[TEN] // 16), *(-(-c // 4) for c in counts[:TEN]))
+    return full_shoe(num_decks)
+
+def card_of(index):
+    return main.card_with_value(VALUES[index])
+
+def strategy_ev(ai_type, num_decks=1, counts=None):
+    # The EV per round of ai_type, at the start of a shoe by default.
+    if counts is None:
+        counts = full_shoe(num_decks)
+    return StrategyEvaluator(ai_type, counts).round_ev()
+
+def optimal_ev(num_decks=1, counts=None):
+    # The EV per round of the best possible play for each starting hand,
+    # with insurance never taken.
+    if counts is None:
+        counts = full_shoe(num_decks)
+
+    ev = 0.0
+    for p1, i, after1 in draws(counts):
+        for p2, up, after2 in draws(after1):
+            for p3, j, rest in draws(after2):
+                p = p1 * p2 * p3
+                dealer_blackjack = dealer_blackjack_chance(rest, up)
+                total, soft = add_value(*add_value(0, False, VALUES[i]), VALUES[j])
+                if total == 21:
+                    ev += p * (1 - dealer_blackjack) * blackjack_payout()
+                    continue
+                options = [
+                    -SURRENDER_LOSS if RULES.surrender else -2.0,
+                    stand_ev(rest, total, up),
+                    hit_ev(rest, total, soft, up),
+                    double_ev(rest, total, soft, up)]
+                if i == j:
+                    options.append(split_ev(rest, i, up))
+                ev += p * ((1 - dealer_blackjack) * max(options) - dealer_blackjack)
+    return ev
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+
+    ai_type_group = parser.add_mutually_exclusive_group()
+    ai_type_group.add_argument("-s", "--stand",
+        help="score the AI that always stands",
+        dest="ai_type", action="store_const", const=main.PlayerAIStand)
+    ai_type_group.add_argument("-r", "--rules",
+        help="score the AI that follows a set of rules",
+        dest="ai_type", action="store_const", const=main.PlayerAIRules)
+    ai_type_group.add_argument("-c", "--counting",
+        help="score the card-counting AI (default)",
+        dest="ai_type", action="store_const", const=main.PlayerAICardCounting)
+    ai_type_group.add_argument("-ac", "--advanced_counting",
+        help="score the card-counting AI that deviates from basic strategy",
+        dest="ai_type", action="store_const", const=main.PlayerAIAdvancedCardCount)
+    ai_type_group.add_argument("-o", "--optimal",
+        help="compute the EV of perfect play for each starting hand",
+        dest="ai_type", action="store_const", const="optimal")
+    parser.set_defaults(ai_type=main.PlayerAICardCounting)
+
+    parser.add_argument("-d", "--num-decks",
+        help="set the number of decks in the shoe (default 1)",
+        dest="num_decks", metavar="NUM",
+        type=int, default=1)
+    parser.add_argument("--house-rules", metavar="CHANGES",
+        help="change the house rules, e.g. hit_soft_17=1,blackjack_pays=6:5"
+            " (see main.HouseRules; max_splits can't be changed)",
+        dest="house_rules", default="default")
+    parser.add_argument("--hand", metavar="VALUES",
+        help="show the EV of each choice for a hand instead, e.g. '10,6' (A for Ace)")
+    parser.add_argument("--upcard", metavar="VALUE",
+        help="the dealer upcard for --hand (default 10)",
+        default="10")
+    args = parser.parse_args()
+
+    try:
+        set_rules(main.HouseRules.parse(args.house_rules))
+    except ValueError as e:
+        parser.error(f"--house-rules: {e}")
+
+    start = time.perf_counter()
+
+    if args.hand:
+        def parse_card(value):
+            return main.card_with_value(11 if value.upper() == "A" else int(value))
+        try:
+            cards = [parse_card(v) for v in args.hand.split(",")]
+            upcard = parse_card(args.upcard)
+        except (ValueError, StopIteration):
+            parser.error("cards must be 2-10 or A")
+        hand = main.Hand("Player", *cards)
+        if hand.total > 21:
+            parser.error(f"the hand is already bust ({hand.total})")
+
+        for choice, ev in hand_evs(hand, upcard, num_decks=args.num_decks).items():
+            print(f"{main.PlayerAI.choice_names[choice]:12} {ev:+.6f}")
+    else:
+        if args.ai_type == "optimal":
+            ev = optimal_ev(args.num_decks)
+        else:
+            ev = strategy_ev(args.ai_type, args.num_decks)
+        print(f"EV per round: {ev:+.4%} of the bet")
+
+    print(f"({time.perf_counter() - start:.1f}s)")
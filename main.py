@@ -1,6 +1,17 @@
 import sys
-from random import shuffle
+import time
+import types
+import random
+import hashlib
+import statistics
+import struct
 import itertools
+import math
+import os
+import pickle
+import collections
+import functools
+import json
 
 #Important notes on the game.
 #Blackjacks are paid out 3 to 2, or 1.5x the bet.
@@ -19,6 +30,27 @@ import itertools
 #If you split Aces, you may only take one hit on each hand.
 #When splitting, you split your two cards and place an equal second bet on the second hand.
 #You may split up to having 4 hands in play.
+#These are the default house rules; see HouseRules for the ones that can be
+#changed.
+
+def make_rng(seed=None, fast=False):
+    # seed may be None (seed from the OS), an int, or a generator that is
+    # used as is: a random.Random or a NumPy Generator. With fast=True,
+    # a NumPy Generator is created, which shuffles big shoes much faster.
+    if seed is not None and not isinstance(seed, int):
+        return seed
+    if fast:
+        import numpy
+        return numpy.random.default_rng(seed)
+    return random.Random(seed)
+
+def derive_seed(seed, *path):
+    # Seed for an independent substream of seed, e.g. derive_seed(seed, 3)
+    # for worker 3. Unseeded runs stay unseeded.
+    if seed is None:
+        return None
+    digest = hashlib.sha256(repr((seed, *path)).encode()).digest()
+    return int.from_bytes(digest[:16], "little")
 
 def map_value(x, l1, h1, l2, h2, *, clamp=True):
     i = (x - l1) / (h1 - l1)
@@ -36,12 +68,16 @@ class Card:
 
     # suit: 0..3 (clubs, diamonds, hearts, spades)
     # rank: 0..12
+    # index: 0..51, the card's position in CARDS (rank * 4 + suit)
     # base_value for Aces is ALWAYS 11. Reduction is done in
     #  the hand.
+    
+    __slots__ = ("suit", "rank", "index", "base_value")
 
     def __init__(self, suit, rank):
         self.suit = suit
         self.rank = rank
+        self.index = rank * 4 + suit
 
         value = rank + 1
         if value > 10:
@@ -50,63 +86,205 @@ class Card:
             self.base_value = 11
         else:
             self.base_value = value
-        
-        if self.base_value <= 6:
-            self.cc_value = +1
-        elif self.base_value >= 10:
-            self.cc_value = -1
-        else:
-            self.cc_value = 0
 
     def __str__(self):
         suit = Card.suit_symbols[self.suit]
         rank = Card.rank_symbols[self.rank]
         return rank + suit
 
-class Hand:
-    def __init__(self, name, *cards, times_split=0):
+# There are only 52 distinct cards, so they are all created once here, and
+# everything else (shoes in particular) refers to them by index.
+CARDS = tuple(Card(s, r) for r in range(13) for s in range(4))
+BASE_VALUES = bytes(c.base_value for c in CARDS)
+
+class CountingSystem:
+    # A card counting system, defined by the tag it gives each rank.
+    # tags: 13 tags, for A, 2, ..., 10, J, Q, K (as Card.rank)
+    # Unbalanced systems (whose tags don't add up to 0 over a deck) start
+    # the running count below 0, so it reaches 0 with one deck left.
+    
+    # Tags are stored shifted up by this much so they fit in bytes.
+    OFFSET = 4
+    
+    def __init__(self, name, tags):
+        assert len(tags) == 13 and all(-self.OFFSET <= t < self.OFFSET for t in tags)
         self.name = name
-        self.cards = []
+        self.tags = tuple(tags)
+        # Tag by card index
+        self.values = tuple(self.tags[c.rank] for c in CARDS)
+        # For bytes.translate, see count()
+        self.shifted = bytes(self.values[i] + self.OFFSET if i < 52 else 0
+            for i in range(256))
+        self.imbalance = sum(self.tags) * 4
+    
+    def initial_count(self, num_decks):
+        return -self.imbalance * (num_decks - 1)
+    
+    def count(self, cards):
+        # The sum of the tags of cards, bytes of card indexes.
+        return sum(cards.translate(self.shifted)) - len(cards) * self.OFFSET
+    
+    def __repr__(self):
+        return f"CountingSystem({self.name!r}, {self.tags})"
+
+class MultiCount:
+    # Counts cards for several systems in one pass. Each card's tags are
+    # packed into one int, a field of FIELD_BITS bits per system, so adding
+    # up the packed ints adds up every system's tags at once.
+    
+    FIELD_BITS = 32
+    
+    def __init__(self, systems):
+        self.systems = tuple(systems)
+        self.packed = tuple(
+            sum((system.values[i] + CountingSystem.OFFSET) << (self.FIELD_BITS * n)
+                for n, system in enumerate(self.systems))
+            for i in range(52))
+    
+    def count(self, cards):
+        # The sum of the tags of cards for each system, as a list.
+        total = sum(map(self.packed.__getitem__, cards))
+        mask = (1 << self.FIELD_BITS) - 1
+        offset = len(cards) * CountingSystem.OFFSET
+        return [((total >> (self.FIELD_BITS * n)) & mask) - offset
+            for n in range(len(self.systems))]
+
+COUNTING_SYSTEMS = {system.name: system for system in (
+    #                        A   2   3   4   5   6   7   8   9  10   J   Q   K
+    CountingSystem("hi-lo", (-1, +1, +1, +1, +1, +1,  0,  0,  0, -1, -1, -1, -1)),
+    CountingSystem("ko",    (-1, +1, +1, +1, +1, +1, +1,  0,  0, -1, -1, -1, -1)),
+    CountingSystem("hi-opt-ii",
+                            ( 0, +1, +1, +2, +2, +1, +1,  0,  0, -2, -2, -2, -2)),
+    CountingSystem("omega-ii",
+                            ( 0, +1, +1, +2, +2, +2, +1,  0, -1, -2, -2, -2, -2)),
+    CountingSystem("zen",   (-1, +1, +1, +2, +2, +2, +1,  0,  0, -2, -2, -2, -2)),
+)}
+HI_LO = COUNTING_SYSTEMS["hi-lo"]
+
+def hand_transitions():
+    # A hand's total and softness as a state, total * 2 + soft, and the
+    # state it goes to when each card is added, as bytes indexed by
+    # state * 52 + card index. Hands over 21 don't take cards, so only
+    # states up to 21 are filled in.
+    table = bytearray(HAND_STATES * 52)
+    for state in range(HAND_STATES):
+        for card in CARDS:
+            total, soft = divmod(state, 2)
+            total += card.base_value
+            
+            if card.rank == 0:
+                if soft:
+                    # If we already have an ace,
+                    # reduce it, since we'll only
+                    # ever have one non-reduced ace.
+                    total -= 10
+                soft = True
+            
+            if total > 21 and soft:
+                total -= 10
+                soft = False
+            
+            table[state * 52 + card.index] = total * 2 + soft
+    return bytes(table)
+
+HAND_STATES = 22 * 2
+HAND_NEXT = hand_transitions()
+# (total, soft, state) for each state, and for each entry of HAND_NEXT.
+STATE_HANDS = tuple((state >> 1, state & 1 == 1, state) for state in range(64))
+NEXT_HANDS = tuple(STATE_HANDS[state] for state in HAND_NEXT)
+# The first state the dealer stands on (hard 17).
+DEALER_STANDS = 17 * 2
+DEALER_SOFT_17 = DEALER_STANDS + 1
+
+class Hand:
+    # A hand is its state (see HAND_NEXT), kept along with its total and
+    # whether it's soft, and a bytearray of the indexes of its cards (see
+    # CARDS). Adding a card is one NEXT_HANDS lookup. The Card objects and
+    # the hand's name (e.g. "Player Left Right") are only built when
+    # they're asked for, which is mostly for display.
+    
+    __slots__ = ("_name", "parent", "buffer",
+        "state", "total", "soft", "times_split", "splits", "max_splits", "bet")
+    
+    def __init__(self, name, *cards, times_split=0, max_splits=1, parent=None):
+        # For a split hand, name is added to the parent hand's name.
+        # times_split is how many splits led to this hand, and max_splits
+        # how many splits are allowed in the whole round (see HouseRules).
+        # The splits made so far in the round are counted in splits, on
+        # the hand the round started with.
+        self._name = name
+        self.parent = parent
+        self.buffer = bytearray()
+        self.state = 0
         self.total = 0
         self.soft = False
         self.times_split = times_split
+        self.splits = times_split
+        self.max_splits = max_splits
         self.bet = None
         
         for c in cards:
-            self.add_card(c)
+            self.add_index(c.index)
+    
+    @property
+    def name(self):
+        if self.parent is None:
+            return self._name
+        return self.parent.name + self._name
+    
+    @property
+    def cards(self):
+        return [CARDS[i] for i in self.buffer]
+    
+    @property
+    def indexes(self):
+        return bytes(self.buffer)
+    
+    @property
+    def first_hand(self):
+        # The hand the round started with, which this one was split from.
+        hand = self
+        while hand.parent is not None:
+            hand = hand.parent
+        return hand
     
     def can_be_split(self):
+        buffer = self.buffer
         return (
-            self.times_split == 0
-            and len(self.cards) == 2
-            and self.cards[0].base_value == self.cards[1].base_value)
+            len(buffer) == 2
+            and BASE_VALUES[buffer[0]] == BASE_VALUES[buffer[1]]
+            and self.first_hand.splits < self.max_splits)
     
-    def split(self):
+    def split(self, max_splits=1):
+        self.first_hand.splits += 1
         splits = self.times_split + 1
         
-        left = Hand(self.name + " Left",
-            self.cards[0], times_split=splits)
-        right = Hand(self.name + " Right",
-            self.cards[1], times_split=splits)
+        left = Hand(" Left", times_split=splits, max_splits=max_splits, parent=self)
+        left.add_index(self.buffer[0])
+        right = Hand(" Right", times_split=splits, max_splits=max_splits, parent=self)
+        right.add_index(self.buffer[1])
         left.bet = right.bet = self.bet
         
         return left, right
     
     def add_card(self, card):
-        self.cards.append(card)
-        self.total += card.base_value
-        
-        if card.rank == 0:
-            if self.soft:
-                # If we already have an ace,
-                # reduce it, since we'll only
-                # ever have one non-reduced ace.
-                self.total -= 10
-            self.soft = True
-        
-        if self.total > 21 and self.soft:
-            self.total -= 10
-            self.soft = False
+        self.add_index(card.index)
+    
+    def add_index(self, index):
+        if self.state < HAND_STATES:
+            self.total, self.soft, self.state = NEXT_HANDS[self.state * 52 + index]
+        else:
+            # Busted hands aren't in HAND_NEXT; their total just goes up,
+            # with Aces counted as 1.
+            value = BASE_VALUES[index]
+            self.total += 1 if value == 11 else value
+            self.state = self.total * 2
+        self.buffer.append(index)
+    
+    def add_indexes(self, indexes, state):
+        # Adds several cards at once, given the state they lead to.
+        self.total, self.soft, self.state = STATE_HANDS[state]
+        self.buffer += indexes
     
     def card_values(self):
         unreduced_ace = self.soft
@@ -120,14 +298,186 @@ class Hand:
             yield card, card.base_value
     
     def __getitem__(self, key):
-        return self.cards[key]
+        try:
+            return CARDS[self.buffer[key]]
+        except TypeError: # A slice
+            return self.cards[key]
+    
+    def __iter__(self):
+        return map(CARDS.__getitem__, self.buffer)
     
     def __len__(self):
-        return len(self.cards)
+        return len(self.buffer)
     
     def __repr__(self):
         return f"Hand('{self.name}', [{','.join(map(str, self.cards))}])"
 
+class Shoe:
+    # The shoe is a shuffled array of card indexes (see CARDS), and cards
+    # are dealt by moving an index through it instead of removing them
+    # from the front. rng is anything make_rng() accepts. A new shoe isn't
+    # shuffled yet: the first shuffle is the simulator's (build_deck), so
+    # the first shoe of a seeded run is the seed's first permutation.
+    
+    def __init__(self, num_decks=1, rng=None):
+        self.num_decks = num_decks
+        self.size = 52 * num_decks
+        self.rng = make_rng(rng)
+        # Same order as a freshly opened set of decks: by rank, then suit.
+        self.unshuffled = bytes(i for i in range(52) for _ in range(num_decks))
+        self.order = bytearray(self.unshuffled)
+        self.dealt = 0
+    
+    def shuffle(self):
+        if hasattr(self.rng, "permutation"):
+            # NumPy Generator
+            self.order = bytearray(self.rng.permutation(memoryview(self.unshuffled)))
+        else:
+            self.order = bytearray(self.unshuffled)
+            self.rng.shuffle(self.order)
+        self.dealt = 0
+    
+    def deal(self):
+        card = CARDS[self.order[self.dealt]]
+        self.dealt += 1
+        return card
+    
+    @property
+    def remaining(self):
+        return self.size - self.dealt
+    
+    @property
+    def penetration(self):
+        return self.dealt / self.size
+    
+    def __len__(self):
+        return self.remaining
+
+class SeededShoe(Shoe):
+    # A shoe that shuffles shoe k of the run (counting from 0) with its own
+    # seed, derive_seed(seed, k), instead of drawing every shoe from one
+    # RNG. Shoes can then be shuffled ahead of time in another process by
+    # a ShoeProducer, and come out the same as when shuffled here.
+    
+    def __init__(self, num_decks=1, seed=None, fast=False):
+        self.num_decks = num_decks
+        self.size = 52 * num_decks
+        self.unshuffled = bytes(i for i in range(52) for _ in range(num_decks))
+        self.seed = seed
+        self.fast = fast
+        self.shoes = 0
+        self.producer = None
+        self.order = bytearray(self.unshuffled)
+        self.dealt = 0
+    
+    @staticmethod
+    def shuffled(num_decks, seed, fast, k):
+        # The order of shoe k.
+        shoe = Shoe.__new__(Shoe)
+        shoe.unshuffled = bytes(i for i in range(52) for _ in range(num_decks))
+        shoe.rng = make_rng(derive_seed(seed, k), fast)
+        Shoe.shuffle(shoe)
+        return shoe.order
+    
+    def shuffle(self):
+        if self.producer is None:
+            self.order = SeededShoe.shuffled(self.num_decks, self.seed, self.fast, self.shoes)
+        else:
+            self.producer.next_order(self.order)
+        self.shoes += 1
+        self.dealt = 0
+    
+    def start_producer(self, slots=8):
+        # Starts shuffling the next shoes in another process.
+        self.producer = ShoeProducer(self.num_decks, self.seed, self.fast,
+            first_shoe=self.shoes, slots=slots)
+    
+    def stop_producer(self):
+        if self.producer is not None:
+            self.producer.close()
+            self.producer = None
+    
+    def __getstate__(self):
+        # For checkpoints: the producer is left behind, and the shoe carries
+        # on shuffling by itself unless a new one is started.
+        state = self.__dict__.copy()
+        state["producer"] = None
+        return state
+
+class ReplayShoe(Shoe):
+    # A shoe that deals another shoe's current order again from the top
+    # instead of shuffling, so several simulators can play the same shoe
+    # (see compare_ais) without shuffling shoes of their own.
+    
+    def __init__(self, source):
+        self.source = source
+        self.num_decks = source.num_decks
+        self.size = source.size
+        self.shuffle()
+    
+    def shuffle(self):
+        self.order = self.source.order
+        self.dealt = 0
+
+class ShoeProducer:
+    # Shuffles the shoes of a SeededShoe in a separate process, and keeps
+    # the next few ready in a ring buffer of slots in shared memory, each
+    # holding one shoe's order as bytes. Two semaphores count the free and
+    # ready slots, so the producer waits when it's ahead and the simulator
+    # only waits if it catches up.
+    
+    def __init__(self, num_decks, seed, fast=False, first_shoe=0, slots=8):
+        import multiprocessing
+        from multiprocessing import shared_memory
+        
+        self.size = 52 * num_decks
+        self.slots = slots
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * self.size)
+        self.free = multiprocessing.Semaphore(slots)
+        self.ready = multiprocessing.Semaphore(0)
+        self.next_slot = 0
+        
+        self.process = multiprocessing.Process(target=produce_shoes, daemon=True,
+            args=(self.memory.name, slots, num_decks, seed, fast, first_shoe,
+                self.free, self.ready))
+        try:
+            self.process.start()
+        except BaseException:
+            self.memory.close()
+            self.memory.unlink()
+            raise
+    
+    def next_order(self, order):
+        # Copies the next shoe into order, a bytearray of the right size.
+        self.ready.acquire()
+        start = self.next_slot * self.size
+        order[:] = self.memory.buf[start:start + self.size]
+        self.free.release()
+        self.next_slot = (self.next_slot + 1) % self.slots
+    
+    def close(self):
+        # Stops the producer and frees the shared memory. The semaphores go
+        # with the last reference to them.
+        try:
+            self.process.terminate()
+            self.process.join()
+        finally:
+            self.memory.close()
+            self.memory.unlink()
+
+def produce_shoes(name, slots, num_decks, seed, fast, first_shoe, free, ready):
+    # The producer process's loop, see ShoeProducer.
+    from multiprocessing import shared_memory
+    
+    memory = shared_memory.SharedMemory(name=name)
+    size = 52 * num_decks
+    for k in itertools.count(first_shoe):
+        order = SeededShoe.shuffled(num_decks, seed, fast, k)
+        free.acquire()
+        start = (k - first_shoe) % slots * size
+        memory.buf[start:start + size] = order
+        ready.release()
+
 class PlayerAI:
     def __init__(self, funds=0):
         self.my_hands = ()
@@ -139,25 +489,36 @@ class PlayerAI:
         
         self.funds = funds
     
-    def deck_shuffled(self, num_decks):
+    def deck_shuffled(self, shoe):
         pass
     
     def view_card(self, card):
         pass
     
+    # AIs that set batch_view get the cards they see in bulk, through
+    # view_cards, instead of one view_card call per card. The cards come as
+    # bytes of card indexes (see CARDS), and are always delivered before
+    # the AI is asked to make a decision and at the end of each round.
+    batch_view = False
+    
+    def view_cards(self, cards):
+        for index in cards:
+            self.view_card(CARDS[index])
+    
     def start_round(self, my_hand, dealer_hand):
         assert not self.my_hands and not self.dealer_hand
-        self.my_hands = {my_hand}
+        self.my_hands = [my_hand]
         self.dealer_hand = dealer_hand
     
     def split_hand(self, old_hand, new_hand1, new_hand2):
-        self.my_hands.remove(old_hand)
-        self.my_hands.add(new_hand1)
-        self.my_hands.add(new_hand2)
+        i = self.my_hands.index(old_hand)
+        self.my_hands[i:i + 1] = new_hand1, new_hand2
     
     def end_hand(self, my_hand):
         self.my_hands.remove(my_hand)
     
+    # Called once per round. result is positive if the player won more
+    # hands than they lost, negative if they lost more, and 0 otherwise.
     def end_round(self, result):
         assert not self.my_hands
         self.dealer_hand = None
@@ -186,6 +547,18 @@ class PlayerAI:
     
     def choice(self, my_hand):
         raise NotImplementedError()
+    
+    # Between rounds, the AI's state can be saved and put back, to play the
+    # same round again (see variants.py). Lists are copied both ways, since
+    # they're changed in place; AIs with other mutable state have to copy
+    # it too.
+    def save_state(self):
+        return {name: value.copy() if type(value) is list else value
+            for name, value in self.__dict__.items()}
+    
+    def restore_state(self, state):
+        self.__dict__ = {name: value.copy() if type(value) is list else value
+            for name, value in state.items()}
 
 class PlayerAIStand(PlayerAI):
     def choice(self, my_hand):
@@ -230,28 +603,270 @@ class PlayerAIRules(PlayerAI):
     def make_bet(self):
         return 10
 
+def card_with_value(value):
+    return next(c for c in CARDS if c.base_value == value)
+
+class StrategyTable:
+    # A playing strategy as a flat table of choices, indexed by the kind of
+    # hand, its total (the card value for pairs), the dealer's upcard and
+    # the true count. True counts outside tc_min..tc_max use the nearest
+    # bucket.
+    
+    HARD = 0
+    SOFT = 1
+    PAIR = 2
+    
+    kind_names = ["hard", "soft", "pair"]
+    upcards = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+    choice_symbols = "HSDP"
+    
+    def __init__(self, tc_min=0, tc_max=0):
+        self.tc_min = tc_min
+        self.tc_max = tc_max
+        self.buckets = tc_max - tc_min + 1
+        self.choices = bytearray(3 * 22 * 12 * self.buckets)
+    
+    def index(self, kind, total, upcard, true_count=0):
+        bucket = min(max(true_count, self.tc_min), self.tc_max) - self.tc_min
+        return ((kind * 22 + total) * 12 + upcard) * self.buckets + bucket
+    
+    def lookup(self, hand, upcard, true_count=0):
+        if hand.can_be_split():
+            kind = StrategyTable.PAIR
+            total = hand[0].base_value
+        else:
+            kind = StrategyTable.SOFT if hand.soft else StrategyTable.HARD
+            total = hand.total
+        # Same as index(), inlined since this runs for every decision.
+        bucket = min(max(true_count, self.tc_min), self.tc_max) - self.tc_min
+        return self.choices[
+            ((kind * 22 + total) * 12 + upcard) * self.buckets + bucket]
+    
+    @staticmethod
+    def sample_hands():
+        # One (kind, total, hand) for each row of the table. Hands that
+        # aren't pairs are marked as split so they can't be split again.
+        for value in range(2, 12):
+            card = card_with_value(value)
+            yield StrategyTable.PAIR, value, Hand("Player", card, card)
+        for total in range(12, 21):
+            # Soft 12 is two Aces
+            other = card_with_value(total - 11 if total > 12 else 11)
+            yield StrategyTable.SOFT, total, Hand("Player",
+                card_with_value(11), other, times_split=1)
+        for total in range(4, 21):
+            first = min(10, total - 2)
+            yield StrategyTable.HARD, total, Hand("Player",
+                card_with_value(first), card_with_value(total - first),
+                times_split=1)
+    
+    @classmethod
+    def compile(cls, ai_type, tc_min=-3, tc_max=5):
+        # Fills in the table by asking ai_type.rules_choice about every
+        # entry. The AI gets an untouched one-deck shoe, so its running
+        # count is also its true count.
+        table = cls(tc_min, tc_max)
+        
+        probe = ai_type()
+        probe.deck_shuffled(types.SimpleNamespace(num_decks=1, dealt=0))
+        
+        for upcard in StrategyTable.upcards:
+            probe.dealer_hand = Hand("Dealer", card_with_value(upcard))
+            for kind, total, hand in StrategyTable.sample_hands():
+                for true_count in range(tc_min, tc_max + 1):
+                    probe.running_count = true_count
+                    probe.update_true_count()
+                    table.choices[table.index(kind, total, upcard, true_count)] = (
+                        probe.rules_choice(hand))
+        
+        return table
+    
+    @classmethod
+    def load(cls, path):
+        # Reads a table written by save(). Each line holds a kind, a total
+        # and one of H, S, D or P for each upcard. Missing rows are hit,
+        # except missing pairs, which are played like their total.
+        # Prose like BasicStrategy-old.txt isn't read: its rules can't be
+        # parsed reliably, and it has no rows for pairs or soft hands.
+        table = cls()
+        given = set()
+        
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.split("#")[0].split()
+                if not line:
+                    continue
+                try:
+                    kind = StrategyTable.kind_names.index(line[0])
+                    total = int(line[1])
+                    choices = [StrategyTable.choice_symbols.index(c)
+                        for c in line[2:]]
+                except ValueError:
+                    choices = None
+                if (not choices or len(choices) != len(StrategyTable.upcards)
+                        or not 2 <= total <= 21):
+                    raise ValueError(f"{path}:{line_number}: invalid row")
+                
+                given.add((kind, total))
+                for upcard, choice in zip(StrategyTable.upcards, choices):
+                    table.choices[table.index(kind, total, upcard)] = choice
+        
+        for value in range(2, 12):
+            if (StrategyTable.PAIR, value) not in given:
+                if value == 11:
+                    kind, total = StrategyTable.SOFT, 12
+                else:
+                    kind, total = StrategyTable.HARD, 2 * value
+                for upcard in StrategyTable.upcards:
+                    table.choices[table.index(StrategyTable.PAIR, value, upcard)] = (
+                        table.choices[table.index(kind, total, upcard)])
+        
+        return table
+    
+    def save(self, path, true_count=0):
+        with open(path, "w", encoding="utf-8") as f:
+            print("# H: hit, S: stand, D: double down, P: split", file=f)
+            print("#      ", *(
+                "A" if u == 11 else str(u)
+                for u in StrategyTable.upcards), file=f)
+            for kind, total, _ in StrategyTable.sample_hands():
+                print(f"{StrategyTable.kind_names[kind]} {total:2}", *(
+                    StrategyTable.choice_symbols[
+                        self.choices[self.index(kind, total, upcard, true_count)]]
+                    for upcard in StrategyTable.upcards), file=f)
+
 class PlayerAICardCounting(PlayerAI):
-    def deck_shuffled(self, num_decks):
-        self.num_decks = num_decks
-        self.running_count = 0
-        self.cards_played = 0
+    # How finely the number of decks left in the shoe is estimated for the
+    # true count: in whole decks (like a player eyeing the discard tray), in
+    # half decks, or exactly (0).
+    DECK_RESOLUTIONS = {"deck": 1, "half": 0.5, "exact": 0}
+    
+    counting_system = HI_LO
+    
+    # The bet goes from min_bet at true count low up to max_bet at true
+    # count high: (low, high, min_bet, max_bet), see make_bet.
+    bet_ramp = (0, 10, 10, 10000)
+    
+    # Sizes the bets instead of bet_ramp if set, e.g. a KellyBetting.
+    bet_policy = None
+    
+    def __init__(self, funds=0, deck_resolution=1, fractional=False,
+            counting_system=None, side_systems=(), bet_ramp=None, index_shift=0,
+            bet_policy=None):
+        super().__init__(funds)
+        
+        # Unless fractional, the true count is rounded down to an int.
+        # table_count is the count the AI plays at: the true count rounded
+        # down, minus index_shift. A shift of +1 moves every deviation from
+        # basic strategy (and the insurance and surrender indexes) one
+        # true count higher.
+        self.deck_resolution = deck_resolution
+        self.fractional = fractional
+        self.index_shift = index_shift
+        if bet_ramp is not None:
+            self.bet_ramp = tuple(bet_ramp)
+        if bet_policy is not None:
+            self.bet_policy = bet_policy
+        
+        # The AI counts, bets and plays by counting_system. The side systems
+        # are counted alongside it, in the same pass over the cards, so they
+        # can be compared (see system_true_counts).
+        if counting_system is not None:
+            self.counting_system = counting_system
+        self.side_systems = tuple(system for system in side_systems
+            if system is not self.counting_system)
+        if self.side_systems:
+            self.multi_count = MultiCount((self.counting_system, *self.side_systems))
+        else:
+            self.multi_count = None
+        
+        self.compile_strategy()
+    
+    @classmethod
+    def compile_strategy(cls):
+        # The strategy in rules_choice is compiled into a table the first
+        # time each class is used, and choice() only looks things up.
+        if "strategy" not in cls.__dict__:
+            cls.strategy = None # Compiling creates an instance too
+            cls.strategy = StrategyTable.compile(cls)
+    
+    def __setstate__(self, state):
+        # AIs restored from a checkpoint skip __init__, so their class's
+        # strategy may not have been compiled yet in this process.
+        self.__dict__.update(state)
+        self.compile_strategy()
+    
+    def deck_shuffled(self, shoe):
+        self.shoe = shoe
+        self.num_decks = shoe.num_decks
+        self.running_count = self.counting_system.initial_count(self.num_decks)
+        self.side_counts = [system.initial_count(self.num_decks)
+            for system in self.side_systems]
+        self.update_true_count()
+    
+    batch_view = True
     
     def view_card(self, card):
-        self.running_count += card.cc_value
-        self.cards_played += 1
+        self.running_count += self.counting_system.values[card.index]
+        for n, system in enumerate(self.side_systems):
+            self.side_counts[n] += system.values[card.index]
+        self.update_true_count()
+    
+    def view_cards(self, cards):
+        if self.multi_count is None:
+            self.running_count += self.counting_system.count(cards)
+        else:
+            running_count, *side_counts = self.multi_count.count(cards)
+            self.running_count += running_count
+            self.side_counts = [a + b for a, b in zip(self.side_counts, side_counts)]
+        self.update_true_count()
     
     @property
-    def true_count(self):
-        return self.running_count // (self.num_decks - (self.cards_played // 52))
+    def cards_played(self):
+        return self.shoe.dealt
+    
+    def decks_left(self):
+        # The number of decks left in the shoe, as estimated for the true
+        # count.
+        resolution = self.deck_resolution
+        if resolution == 1:
+            return self.num_decks - self.cards_played // 52
+        elif resolution:
+            return (self.num_decks
+                - self.cards_played // (52 * resolution) * resolution)
+        else:
+            return self.num_decks - self.cards_played / 52
+    
+    def to_true_count(self, running_count, decks_left):
+        if self.fractional:
+            return running_count / decks_left
+        return int(running_count // decks_left)
+    
+    def update_true_count(self):
+        # The true count is kept as a plain attribute, so the bet and the
+        # play decisions can read it as often as they like. It only changes
+        # when the running count or the number of cards played does, so
+        # this is called whenever the AI is shown cards (or its running
+        # count is set by hand).
+        self.true_count = self.to_true_count(self.running_count, self.decks_left())
+        self.table_count = math.floor(self.true_count) - self.index_shift
+    
+    def system_true_counts(self):
+        # The true count for each counting system, by name.
+        decks_left = self.decks_left()
+        true_counts = {self.counting_system.name: self.true_count}
+        for system, running_count in zip(self.side_systems, self.side_counts):
+            true_counts[system.name] = self.to_true_count(running_count, decks_left)
+        return true_counts
     
     def make_bet(self):
-        return map_value(self.true_count,
-            0, 10,
-            10, 10000)
+        if self.bet_policy is not None:
+            return self.bet_policy.bet(self.true_count, self.funds)
+        return map_value(self.true_count, *self.bet_ramp)
     
     def choose_surrender(self):
         assert len(self.my_hands) == 1
-        hand = next(iter(self.my_hands))
+        hand = self.my_hands[0]
         
         if hand.total == 16:
             return self.dealer_hand[0].base_value >= 9
@@ -260,6 +875,10 @@ class PlayerAICardCounting(PlayerAI):
         return False
     
     def choice(self, my_hand):
+        return self.strategy.lookup(my_hand,
+            self.dealer_hand[0].base_value, self.table_count)
+    
+    def rules_choice(self, my_hand):
         assert my_hand.total != 21
         
         dealer_value = self.dealer_hand[0].base_value
@@ -354,12 +973,12 @@ class PlayerAICardCounting(PlayerAI):
 class PlayerAIAdvancedCardCount(PlayerAICardCounting):
     
     def choose_insurance(self):
-        if self.true_count >= 3:
+        if self.table_count >= 3:
             return True
         else:
             return False
             
-    def choice(self, my_hand):
+    def rules_choice(self, my_hand):
         assert my_hand.total != 21
         
         dealer_value = self.dealer_hand[0].base_value
@@ -409,23 +1028,33 @@ class PlayerAIAdvancedCardCount(PlayerAICardCounting):
                 return PlayerAI.CH_HIT
             elif dealer_value == 3 and self.true_count < -2:
                 return PlayerAI.CH_HIT
-        return super().choice(my_hand)
+        return super().rules_choice(my_hand)
     
     def choose_surrender(self):
         assert len(self.my_hands) == 1
-        hand = next(iter(self.my_hands))
+        hand = self.my_hands[0]
         
         if hand.total == 14:
-            return self.dealer_hand[0].base_value == 10 and self.true_count >= 3
+            return self.dealer_hand[0].base_value == 10 and self.table_count >= 3
         elif hand.total == 15:
-            if self.true_count >= 0:
+            if self.table_count >= 0:
                 return self.dealer_hand[0].base_value == 10
-            if self.true_count >= 2:
+            if self.table_count >= 2:
                 return self.dealer_hand[0].base_value == 9
-            if self.true_count >= 1:
+            if self.table_count >= 1:
                 return self.dealer_hand[0].base_value == 11
         return super().choose_surrender()
 
+class PlayerAITable(PlayerAICardCounting):
+    # Counts cards and bets like PlayerAICardCounting, but plays by a
+    # strategy table loaded from a file (see BasicStrategy.txt).
+    
+    strategy = None
+    
+    def __init__(self, strategy_file, funds=0, **count_options):
+        super().__init__(funds, **count_options)
+        self.strategy = StrategyTable.load(strategy_file)
+
 class PlayerAIManual(PlayerAI):
     
     def choose_insurance(self):
@@ -465,17 +1094,494 @@ def input_yes_no(prompt):
         print(prompt)
     return input().strip().lower() in ("y", "yes")
 
+AI_TYPES = {
+    "stand": PlayerAIStand,
+    "rules": PlayerAIRules,
+    "counting": PlayerAICardCounting,
+    "advanced_counting": PlayerAIAdvancedCardCount,
+}
+
+class RecordWriter:
+    # Writes one fixed-size binary record per round, in batches. After a
+    # short header, each record holds:
+    #   bet         float64  the bet at the start of the round
+    #   net         float64  the change in the player's funds
+    #   true_count  float32  the player's true count when betting (0 if
+    #                        it doesn't count)
+    #   insurance   float32  the insurance bet
+    #   surrender   uint8    1 if the player surrendered
+    #   hands       uint8    the number of hands played
+    #   outcomes    4 int8   +1 win, 0 draw, -1 loss for each hand
+    # followed by 2 bytes of padding. load_records() maps a file into a
+    # NumPy record array.
+    
+    # The most hands a round can have, as the records hold their outcomes
+    # (see HouseRules.max_splits).
+    MAX_HANDS = 4
+    
+    header = struct.Struct("<8sII")
+    record = struct.Struct("<ddffBB4b2x")
+    magic = b"BJRECORD"
+    version = 1
+    
+    def __init__(self, path, batch_size=4096, resume_at=None):
+        # resume_at: the size the file had at a checkpoint (see tell()).
+        # The file is cut back to it and new records go after it.
+        self.path = path
+        if resume_at is None:
+            self.file = open(path, "wb")
+            self.file.write(RecordWriter.header.pack(
+                RecordWriter.magic, RecordWriter.version, RecordWriter.record.size))
+        else:
+            self.file = open(path, "r+b")
+            if self.file.seek(0, os.SEEK_END) < resume_at:
+                raise ValueError(f"{path} is shorter than at the checkpoint")
+            self.file.truncate(resume_at)
+            self.file.seek(resume_at)
+        self.buffer = bytearray(batch_size * RecordWriter.record.size)
+        self.batch_size = batch_size
+        self.count = 0
+    
+    def write(self, bet, true_count, insurance, surrendered, outcomes, net):
+        hands = len(outcomes)
+        if hands < RecordWriter.MAX_HANDS:
+            outcomes = outcomes + [0] * (RecordWriter.MAX_HANDS - hands)
+        RecordWriter.record.pack_into(self.buffer,
+            self.count * RecordWriter.record.size,
+            bet, net, true_count, insurance, surrendered, hands, *outcomes)
+        
+        self.count += 1
+        if self.count == self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        self.file.write(memoryview(self.buffer)[:self.count * RecordWriter.record.size])
+        self.count = 0
+        self.file.flush()
+    
+    def tell(self):
+        # Writes out everything so far, down to the disk, and returns the
+        # size of the file.
+        self.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def load_records(path):
+    import numpy
+    
+    with open(path, "rb") as f:
+        magic, version, size = RecordWriter.header.unpack(
+            f.read(RecordWriter.header.size))
+    if magic != RecordWriter.magic or version != RecordWriter.version:
+        raise ValueError(f"{path} is not a round record file")
+    
+    dtype = numpy.dtype([
+        ("bet", "<f8"),
+        ("net", "<f8"),
+        ("true_count", "<f4"),
+        ("insurance", "<f4"),
+        ("surrender", "u1"),
+        ("hands", "u1"),
+        ("outcomes", "i1", (4,)),
+        ("padding", "V2"),
+    ])
+    assert dtype.itemsize == size
+    return numpy.memmap(path, dtype=dtype, mode="r",
+        offset=RecordWriter.header.size)
+
+class RunningStats:
+    # Mean and variance of a stream of numbers, updated one at a time with
+    # Welford's algorithm. merge() combines two streams.
+    
+    __slots__ = ("n", "mean", "m2")
+    
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+    
+    def merge(self, other):
+        n = self.n + other.n
+        if n == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+    
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+    
+    @property
+    def stdev(self):
+        return self.variance ** 0.5
+    
+    @property
+    def error(self):
+        # Half-width of the 95% confidence interval for the mean.
+        return 1.96 * self.stdev / self.n ** 0.5 if self.n else float("inf")
+
+class SimulationStats:
+    # Per-round statistics for a run, in constant memory:
+    # - the mean and standard deviation of the profit per round,
+    # - the same for each true count (rounded down) at the time of the bet,
+    # - the largest drop of the bankroll from a previous high,
+    # - a histogram of the bankroll over the run, as the number of rounds
+    #   started in each range. Its bins double in width whenever there
+    #   would be more than max_bins of them.
+    # - the risk of ruin for a given bankroll, from the mean and variance.
+    # Stats from parallel workers can be merged; the merged rounds are
+    # taken as played one after the other, as a single session would, so
+    # the drawdown is the one of the whole run. The histogram is shifted by
+    # the bankroll the other stats start from, rounded to the nearest bin.
+    
+    def __init__(self, bin_width=100, max_bins=32):
+        self.rounds = RunningStats()
+        self.by_count = {}
+        # Result per unit bet by true count, for each counting system the
+        # player kept a count for (see PlayerAICardCounting.side_systems)
+        self.by_system = {}
+        
+        self.bankroll = 0
+        self.peak = 0
+        self.trough = 0
+        self.max_drawdown = 0
+        
+        self.bin_width = bin_width
+        self.max_bins = max_bins
+        self.histogram = {}
+    
+    def add(self, net, true_count, bet=0, system_counts=None):
+        self.rounds.add(net)
+        
+        bucket = int(true_count // 1)
+        stats = self.by_count.get(bucket)
+        if stats is None:
+            stats = self.by_count[bucket] = RunningStats()
+        stats.add(net)
+        
+        if system_counts and bet:
+            for name, count in system_counts.items():
+                by_count = self.by_system.setdefault(name, {})
+                bucket = int(count // 1)
+                stats = by_count.get(bucket)
+                if stats is None:
+                    stats = by_count[bucket] = RunningStats()
+                stats.add(net / bet)
+        
+        histogram = self.histogram
+        b = int(self.bankroll // self.bin_width)
+        if b in histogram:
+            histogram[b] += 1
+        else:
+            histogram[b] = 1
+            if len(histogram) > self.max_bins:
+                self.widen_bins()
+        
+        self.bankroll += net
+        if self.bankroll > self.peak:
+            self.peak = self.bankroll
+        else:
+            if self.peak - self.bankroll > self.max_drawdown:
+                self.max_drawdown = self.peak - self.bankroll
+            if self.bankroll < self.trough:
+                self.trough = self.bankroll
+    
+    def widen_bins(self):
+        self.histogram = halve_bins(self.histogram)
+        self.bin_width *= 2
+    
+    def merge(self, other):
+        self.rounds.merge(other.rounds)
+        for bucket, stats in other.by_count.items():
+            self.by_count.setdefault(bucket, RunningStats()).merge(stats)
+        for name, by_count in other.by_system.items():
+            mine = self.by_system.setdefault(name, {})
+            for bucket, stats in by_count.items():
+                mine.setdefault(bucket, RunningStats()).merge(stats)
+        
+        # other's rounds come after ours, starting from our bankroll.
+        start = self.bankroll
+        self.max_drawdown = max(self.max_drawdown, other.max_drawdown,
+            self.peak - (start + other.trough))
+        self.peak = max(self.peak, start + other.peak)
+        self.trough = min(self.trough, start + other.trough)
+        self.bankroll += other.bankroll
+        
+        histogram = other.histogram
+        bin_width = other.bin_width
+        while bin_width < self.bin_width:
+            histogram = halve_bins(histogram)
+            bin_width *= 2
+        while self.bin_width < bin_width:
+            self.widen_bins()
+        shift = round(start / self.bin_width)
+        for b, count in histogram.items():
+            b += shift
+            self.histogram[b] = self.histogram.get(b, 0) + count
+        while len(self.histogram) > self.max_bins:
+            self.widen_bins()
+    
+    def risk_of_ruin(self, bankroll):
+        # The chance of ever losing the whole bankroll playing on at this
+        # mean and variance per round: exp(-2 * mean * bankroll / variance),
+        # the diffusion approximation. Certain ruin without an edge.
+        mean, variance = self.rounds.mean, self.rounds.variance
+        if mean <= 0:
+            return 1.0
+        if variance == 0:
+            return 0.0
+        return math.exp(-2 * mean * bankroll / variance)
+    
+    def report(self, bankroll=None):
+        lines = [
+            f"Rounds:        {self.rounds.n}",
+            f"EV per round:  {self.rounds.mean:+.3f} ± {self.rounds.error:.3f}"
+                f" (std dev {self.rounds.stdev:.3f})",
+            f"Max drawdown:  {self.max_drawdown}",
+        ]
+        if bankroll is not None:
+            lines.append(f"Risk of ruin:  {self.risk_of_ruin(bankroll):.2%}"
+                f" with a bankroll of {bankroll}")
+        lines.append("EV per round by true count:")
+        for bucket in sorted(self.by_count):
+            stats = self.by_count[bucket]
+            lines.append(f"  {bucket:+4}  {stats.n:>10} rounds  "
+                f"{stats.mean:+10.3f} ± {stats.error:.3f}")
+        
+        for name, by_count in self.by_system.items():
+            lines.append(f"Result per unit bet by {name} true count:")
+            for bucket in sorted(by_count):
+                stats = by_count[bucket]
+                lines.append(f"  {bucket:+4}  {stats.n:>10} rounds  "
+                    f"{stats.mean:+10.4f} ± {stats.error:.4f}")
+        
+        lines.append("Rounds started at each bankroll:")
+        most = max(self.histogram.values(), default=0)
+        for b in sorted(self.histogram):
+            count = self.histogram[b]
+            low = b * self.bin_width
+            lines.append(f"  {low:>+12.0f} to {low + self.bin_width:>+12.0f}  "
+                f"{count:>10}  {'#' * round(40 * count / most)}")
+        return lines
+
+def halve_bins(histogram):
+    # Merges each pair of neighbouring histogram bins.
+    merged = {}
+    for b, count in histogram.items():
+        merged[b // 2] = merged.get(b // 2, 0) + count
+    return merged
+
+class Profiler:
+    # Counts the calls to the functions it wraps and the time spent in them,
+    # both in total and excluding the time spent in other wrapped functions
+    # they call ("self" time). See BlackjackSimulator.enable_profiling.
+    
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.total = collections.Counter()
+        self.exclusive = collections.Counter()
+        # Time spent in wrapped calls made by each running wrapped call
+        self.stack = []
+    
+    def wrap(self, name, func):
+        perf_counter = time.perf_counter
+        stack = self.stack
+        
+        def profiled(*args, **kwargs):
+            start = perf_counter()
+            stack.append(0.0)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                self.calls[name] += 1
+                self.total[name] += elapsed
+                self.exclusive[name] += elapsed - stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+        return profiled
+    
+    def merge(self, other):
+        self.calls.update(other.calls)
+        self.total.update(other.total)
+        self.exclusive.update(other.exclusive)
+    
+    def report(self):
+        grand_total = sum(self.exclusive.values()) or 1
+        lines = [f"{'Function':24} {'Calls':>10} {'Total s':>9} {'Self s':>9}"
+            f" {'Self us/call':>12} {'Self %':>7}"]
+        for name, seconds in self.exclusive.most_common():
+            calls = self.calls[name]
+            lines.append(f"{name:24} {calls:>10} {self.total[name]:>9.3f}"
+                f" {seconds:>9.3f} {seconds / calls * 1e6:>12.2f}"
+                f" {seconds / grand_total:>7.1%}")
+        return lines
+
+class HouseRules:
+    # The rules of the table, the ones that vary between casinos:
+    #   hit_soft_17         whether the dealer hits soft 17
+    #   blackjack_pays      a player blackjack pays (a, b), a to b
+    #   insurance_bet       the insurance bet, 0 if insurance isn't offered
+    #   surrender           whether (late) surrender is allowed
+    #   max_splits          how many splits are allowed in a round, 1 to 3
+    #                       (a round has at most RecordWriter.MAX_HANDS hands)
+    #   double_after_split  whether split hands may be doubled down
+    # The defaults are the rules the simulator has always played by. The
+    # AIs aren't told the rules: when one makes a choice they don't allow,
+    # a surrender is ignored and a double down is played as a hit.
+    
+    def __init__(self, hit_soft_17=False, blackjack_pays=(3, 2), insurance_bet=5,
+            surrender=True, max_splits=1, double_after_split=True):
+        if not 1 <= max_splits < RecordWriter.MAX_HANDS:
+            raise ValueError(f"max_splits must be 1 to {RecordWriter.MAX_HANDS - 1}")
+        pays, per = blackjack_pays
+        if pays < 0 or per <= 0:
+            raise ValueError("blackjack_pays must be a:b with a at least 0 and b above 0")
+        if insurance_bet < 0:
+            raise ValueError("insurance_bet must be at least 0")
+        self.hit_soft_17 = hit_soft_17
+        self.blackjack_pays = tuple(blackjack_pays)
+        self.insurance_bet = insurance_bet
+        self.surrender = surrender
+        self.max_splits = max_splits
+        self.double_after_split = double_after_split
+    
+    def changes(self):
+        # The rules that differ from the defaults, by name.
+        default = vars(HouseRules())
+        return {name: value for name, value in vars(self).items()
+            if value != default[name]}
+    
+    @classmethod
+    def parse(cls, text):
+        # Reads changes to the default rules, as "name=value,...", e.g.
+        # "hit_soft_17=1,blackjack_pays=6:5". "default" is no changes.
+        default = vars(cls())
+        changes = {}
+        for change in text.split(","):
+            change = change.strip()
+            if not change or change == "default":
+                continue
+            name, _, value = change.partition("=")
+            name = name.strip().replace("-", "_")
+            if name not in default:
+                raise ValueError(f"unknown house rule '{name}', the rules are:"
+                    f" {', '.join(default)}")
+            try:
+                if isinstance(default[name], bool):
+                    changes[name] = {"1": True, "yes": True, "true": True,
+                        "0": False, "no": False, "false": False}[value.strip().lower()]
+                elif isinstance(default[name], tuple):
+                    changes[name] = tuple(int(v) for v in value.split(":", 1))
+                    if len(changes[name]) != 2:
+                        raise ValueError()
+                else:
+                    changes[name] = int(value)
+            except (KeyError, ValueError):
+                raise ValueError(f"invalid value for {name}: '{value}'") from None
+        return cls(**changes)
+    
+    def __eq__(self, other):
+        return isinstance(other, HouseRules) and vars(self) == vars(other)
+    
+    def __str__(self):
+        def show(value):
+            if isinstance(value, bool):
+                return str(int(value))
+            if isinstance(value, tuple):
+                return ":".join(map(str, value))
+            return str(value)
+        return ",".join(f"{name}={show(value)}"
+            for name, value in self.changes().items()) or "default"
+    
+    def __repr__(self):
+        return f"HouseRules.parse({str(self)!r})"
+
+class RuleProbe:
+    # Stands in for a HouseRules, and notes the name of every rule that is
+    # read. The simulator only reads a rule when it makes a difference (the
+    # insurance bet with an Ace showing, hit_soft_17 when the dealer gets to
+    # soft 17...), so a round plays out the same under any rules that agree
+    # on the ones it read.
+    
+    def __init__(self, rules):
+        self.rules = rules
+        self.read = set()
+    
+    def __getattr__(self, name):
+        self.read.add(name)
+        return getattr(self.rules, name)
+
 class BlackjackSimulator:
     def __init__(self, player_ai, num_decks=1, shuffle_deck_at=0.5,
-            quiet=False, log_file=None):
+            quiet=False, log_file=None, rng=None, records=None, stats=None,
+            shoe=None, rules=None):
+        # shoe: a Shoe to deal from instead of a new one (e.g. a SeededShoe).
+        # rules: the HouseRules, the defaults if not given.
         self.player_ai = player_ai
+        self.rules = rules or HouseRules()
+        
+        # A RecordWriter, to save every round, and SimulationStats, to
+        # keep statistics on them.
+        self.records = records
+        self.stats = stats
         
         self.num_decks = num_decks
         self.shuffle_deck_at = shuffle_deck_at
+        self.shoe = shoe or Shoe(num_decks, rng)
         self.build_deck()
         
         self.quiet = quiet
         self.log_file = log_file
+        
+        # When nothing is shown on screen and there's no log, there's no
+        # point in building any of the output. The round loop checks this
+        # before every message, so headless runs skip rendering entirely.
+        self.verbose = not quiet or log_file is not None
+        
+        self.profiler = None
+        
+        # Cards seen by a batch_view AI that it hasn't been given yet.
+        self.batch_view = player_ai.batch_view
+        self.revealed = bytearray()
+    
+    def __getstate__(self):
+        # For checkpoints. Open files are left out; the records file is
+        # saved by save_checkpoint and reopened by load_checkpoint.
+        assert self.profiler is None, "profiled simulators can't be saved"
+        state = self.__dict__.copy()
+        state["records"] = state["log_file"] = None
+        return state
+    
+    # What enable_profiling() times.
+    profiled_phases = ["play_round", "play_hand", "deal", "resolve_dealer",
+        "settle", "build_deck"]
+    profiled_callbacks = ["view_card", "view_cards", "choice", "make_bet",
+        "choose_insurance", "choose_surrender"]
+    
+    def enable_profiling(self, profiler=None):
+        # Times the simulator's phases and the AI's callbacks by wrapping
+        # them on the instances, so that there's no cost without profiling.
+        # AI callbacks are listed as "ai.<name>".
+        self.profiler = profiler or Profiler()
+        for name in BlackjackSimulator.profiled_phases:
+            setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        for name in BlackjackSimulator.profiled_callbacks:
+            setattr(self.player_ai, name,
+                self.profiler.wrap("ai." + name, getattr(self.player_ai, name)))
+        return self.profiler
     
     def print(self, *args, loud=False, **kwargs):
         if loud or not self.quiet:
@@ -526,38 +1632,60 @@ class BlackjackSimulator:
         
         self.print()
 
+    def needs_shuffle(self):
+        return self.shoe.remaining < self.shoe.size * self.shuffle_deck_at
+    
     def build_deck(self):
-        self.deck = [Card(s, r)
-            for r in range(13)
-            for s in range(4)
-            for _ in range(self.num_decks)]
-        shuffle(self.deck)
-        self.player_ai.deck_shuffled(self.num_decks)
+        self.shoe.shuffle()
+        self.player_ai.deck_shuffled(self.shoe)
     
     def deal(self, hand, player_sees):
-        card = self.deck.pop(0)
-        hand.add_card(card)
+        shoe = self.shoe
+        index = shoe.order[shoe.dealt]
+        shoe.dealt += 1
+        hand.add_index(index)
         if player_sees:
+            if self.batch_view:
+                self.revealed.append(index)
+            else:
+                self.player_ai.view_card(CARDS[index])
+    
+    def show_card(self, card):
+        # Shows the player a card that was dealt face down.
+        if self.batch_view:
+            self.revealed.append(card.index)
+        else:
             self.player_ai.view_card(card)
+    
+    def flush_revealed(self):
+        # Gives a batch_view AI the cards it has seen since the last time.
+        self.player_ai.view_cards(bytes(self.revealed))
+        self.revealed.clear()
 
     def play_hand(self, player, dealer):
+        verbose = self.verbose
         
         if player.total >= 21:
             if player.total > 21:
-                self.print("Hand busted")
+                if verbose:
+                    self.print("Hand busted")
             self.player_ai.end_hand(player)
             return [player]
         
         #Player makes decision: 0: Hit, 1: Stand, 2: Double Down, 3: Split
-        self.print_hands(player, dealer)
+        if verbose:
+            self.print_hands(player, dealer)
+        if self.revealed:
+            self.flush_revealed()
         player_decision = self.player_ai.choice(player)
-        self.print("Player choice:", PlayerAI.choice_names[player_decision])
+        if verbose:
+            self.print("Player choice:", PlayerAI.choice_names[player_decision])
 
         #Player splits their hand.
         if player_decision == PlayerAI.CH_SPLIT:
             assert player.can_be_split()
             
-            hand1, hand2 = player.split()
+            hand1, hand2 = player.split(self.rules.max_splits)
             self.player_ai.split_hand(player, hand1, hand2)
             
             self.deal(hand1, True)
@@ -570,6 +1698,10 @@ class BlackjackSimulator:
         #Any other action is taken by the player.
         while player_decision != PlayerAI.CH_STAND:
             
+            if (player_decision == PlayerAI.CH_DOUBLE_DOWN and player.times_split
+                    and not self.rules.double_after_split):
+                player_decision = PlayerAI.CH_HIT
+            
             if player_decision == PlayerAI.CH_HIT:
                 self.deal(player, True)
                 
@@ -582,23 +1714,59 @@ class BlackjackSimulator:
                 break
             #Check if the player busted before continuing.
             if player.total > 21:
-                self.print("Hand busted")
+                if verbose:
+                    self.print("Hand busted")
                 break
             if player.total == 21:
                 break
             
-            self.print_hands(player, dealer)
+            if verbose:
+                self.print_hands(player, dealer)
+            if self.revealed:
+                self.flush_revealed()
             player_decision = self.player_ai.choice(player)
-            self.print("Player choice:", PlayerAI.choice_names[player_decision])
+            if verbose:
+                self.print("Player choice:", PlayerAI.choice_names[player_decision])
         
         self.player_ai.end_hand(player)
         return [player]
 
     def play_run(self):
-        
-        if len(self.deck) < 52 * self.num_decks * self.shuffle_deck_at:
+        if self.needs_shuffle():
             self.build_deck()
         
+        if self.records is None and self.stats is None:
+            bet, insurance, surrendered, outcomes = self.play_round()
+            if self.revealed:
+                self.flush_revealed()
+            self.player_ai.end_round(sum(outcomes))
+            return
+        
+        # The count can't change between here and the bet.
+        funds = self.player_ai.funds
+        true_count = getattr(self.player_ai, "true_count", 0)
+        if self.stats is not None and getattr(self.player_ai, "side_systems", None):
+            system_counts = self.player_ai.system_true_counts()
+        else:
+            system_counts = None
+        bet, insurance, surrendered, outcomes = self.play_round()
+        if self.revealed:
+            self.flush_revealed()
+        self.player_ai.end_round(sum(outcomes))
+        
+        net = self.player_ai.funds - funds
+        if self.records is not None:
+            self.records.write(bet, true_count, insurance, surrendered,
+                outcomes, net)
+        if self.stats is not None:
+            self.stats.add(net, true_count, bet, system_counts)
+    
+    def play_round(self):
+        # Plays a round without checking the shoe. Returns the bet, the
+        # insurance bet, whether the player surrendered, and the outcome of
+        # each hand (+1 win, 0 draw, -1 loss).
+        verbose = self.verbose
+        
         #These represent the hands of the player and dealer, respectively.
         player = Hand("Player")
         dealer = Hand("Dealer")
@@ -606,7 +1774,7 @@ class BlackjackSimulator:
         self.player_ai.start_round(player, dealer)
 
         #Player places their bet.
-        player.bet = self.player_ai.make_bet()
+        player.bet = bet = self.player_ai.make_bet()
 
         #Deal cards out.
         #Deal 2 cards to the player and dealer, alternating
@@ -617,12 +1785,19 @@ class BlackjackSimulator:
         
         if dealer[0].base_value == 11:
             #Player can choose to make an insurance bet.
-            self.print_hands(player, dealer)
-            if self.player_ai.choose_insurance():
-                self.print("Player chooses to make an insurance bet.")
-                insurance = 5
+            if verbose:
+                self.print_hands(player, dealer)
+            if self.revealed:
+                self.flush_revealed()
+            # The AI is asked first, so the rule is only read when it
+            # matters (see RuleProbe). The same goes for surrender.
+            if self.player_ai.choose_insurance() and self.rules.insurance_bet:
+                if verbose:
+                    self.print("Player chooses to make an insurance bet.")
+                insurance = self.rules.insurance_bet
             else:
-                self.print("Player does not choose to make an insurance bet.")
+                if verbose:
+                    self.print("Player does not choose to make an insurance bet.")
                 insurance = 0
         else:
             insurance = 0
@@ -632,95 +1807,436 @@ class BlackjackSimulator:
         dealer_blackjack = dealer.total == 21
         
         if player_blackjack and dealer_blackjack:
-            self.print("Player and Dealer Blackjack, Round Draw")
-            self.player_ai.view_card(dealer[1])
-            self.print_hands(player, dealer, hide=())
+            if verbose:
+                self.print("Player and Dealer Blackjack, Round Draw")
+            self.show_card(dealer[1])
+            if verbose:
+                self.print_hands(player, dealer, hide=())
             self.player_ai.funds += (2 * insurance)
             self.player_ai.end_hand(player)
-            self.player_ai.end_round(0)
-            return
+            return bet, insurance, False, [0]
         elif player_blackjack:
-            self.print("Player Blackjack, Player Wins")
-            self.player_ai.view_card(dealer[1])
-            self.print_hands(player, dealer, hide=())
-            self.player_ai.funds += (player.bet * 3 // 2) - insurance
+            if verbose:
+                self.print("Player Blackjack, Player Wins")
+            self.show_card(dealer[1])
+            if verbose:
+                self.print_hands(player, dealer, hide=())
+            pays, per = self.rules.blackjack_pays
+            self.player_ai.funds += (player.bet * pays // per) - insurance
             self.player_ai.end_hand(player)
-            self.player_ai.end_round(+1)
-            return
+            return bet, insurance, False, [+1]
         elif dealer_blackjack:
-            self.print("Dealer Blackjack, Dealer Wins")
-            self.player_ai.view_card(dealer[1])
-            self.print_hands(player, dealer, hide=())
+            if verbose:
+                self.print("Dealer Blackjack, Dealer Wins")
+            self.show_card(dealer[1])
+            if verbose:
+                self.print_hands(player, dealer, hide=())
             self.player_ai.funds += (2 * insurance) - player.bet
             self.player_ai.end_hand(player)
-            self.player_ai.end_round(-1)
-            return
+            return bet, insurance, False, [-1]
         elif insurance != 0:
-            self.print("Dealer does not have Blackjack, Insurance forfeited")
-            self.print_hands(player, dealer)
+            if verbose:
+                self.print("Dealer does not have Blackjack, Insurance forfeited")
+                self.print_hands(player, dealer)
             self.player_ai.funds -= insurance
 
         #Player plays out their hand.
-        self.print_hands(player, dealer)
-        if self.player_ai.choose_surrender():
-            self.print("Player surrender, Dealer Wins")
+        if verbose:
             self.print_hands(player, dealer)
+        if self.revealed:
+            self.flush_revealed()
+        if self.player_ai.choose_surrender() and self.rules.surrender:
+            if verbose:
+                self.print("Player surrender, Dealer Wins")
+                self.print_hands(player, dealer)
             self.player_ai.funds -= (player.bet // 2)
             self.player_ai.end_hand(player)
-            self.player_ai.end_round(-1)
-            return
-        else:
+            return bet, insurance, True, [-1]
+        elif verbose:
             self.print("Player does not surrender.")
         
         results = self.play_hand(player, dealer)
+        return bet, insurance, False, self.settle(player, dealer, results)
+    
+    def settle(self, player, dealer, results):
+        # Plays the dealer's hand if needed, and pays out each of the
+        # player's hands. Returns their outcomes.
+        verbose = self.verbose
         
         #Check what the outcome was.
+        outcomes = [-1] * len(results)
         non_busted_hands = []
         for i, hand in enumerate(results):
             if hand.total > 21:
-                self.print(f"Hand {i}: Player busts, Dealer Wins")
-                self.print_hands(hand, dealer)
+                if verbose:
+                    self.print(f"Hand {i}: Player busts, Dealer Wins")
+                    self.print_hands(hand, dealer)
                 self.player_ai.funds -= player.bet
             else:
                 non_busted_hands.append(results[i])
 
         #If there are no more live hands, continue
         if len(non_busted_hands) == 0:
-            self.player_ai.end_round(-1)
-            return
+            return outcomes
 
-        #Dealer makes decision: hit when below 17 and stand when above 16.
-        self.player_ai.view_card(dealer[1])
-        while dealer.total < 17:
-            self.deal(dealer, True)
+        self.resolve_dealer(dealer)
         
         #Check if the dealer busted.
         if dealer.total > 21:
-            self.print("Dealer Busts, Player Wins")
+            if verbose:
+                self.print("Dealer Busts, Player Wins")
             for hand in non_busted_hands:
-                self.player_ai.view_card(dealer[1])
-                self.print_hands(player, dealer, hide=())
+                self.show_card(dealer[1])
+                if verbose:
+                    self.print_hands(player, dealer, hide=())
                 self.player_ai.funds += hand.bet
-            self.player_ai.end_round(+1)
-            return
+            for i, hand in enumerate(results):
+                if hand.total <= 21:
+                    outcomes[i] = +1
+            return outcomes
 
         #Compare the player's and dealer's hand.
-        self.player_ai.view_card(dealer[1])
-        for hand in non_busted_hands:
+        self.show_card(dealer[1])
+        for i, hand in enumerate(results):
+            if hand.total > 21:
+                continue
             if hand.total > dealer.total:
-                self.print("Player Total Higher, Player Wins")
-                self.print_hands(player, dealer, hide=())
+                if verbose:
+                    self.print("Player Total Higher, Player Wins")
+                    self.print_hands(player, dealer, hide=())
                 self.player_ai.funds += hand.bet
-                self.player_ai.end_round(+1)
+                outcomes[i] = +1
             elif hand.total < dealer.total:
-                self.print("Dealer Total Higher, Dealer Wins")
-                self.print_hands(player, dealer, hide=())
+                if verbose:
+                    self.print("Dealer Total Higher, Dealer Wins")
+                    self.print_hands(player, dealer, hide=())
                 self.player_ai.funds -= hand.bet
-                self.player_ai.end_round(-1)
             else:
-                self.print("Player and Dealer Totals Equal, Draw")
-                self.print_hands(player, dealer, hide=())
-                self.player_ai.end_round(0)
+                if verbose:
+                    self.print("Player and Dealer Totals Equal, Draw")
+                    self.print_hands(player, dealer, hide=())
+                outcomes[i] = 0
+        
+        return outcomes
+    
+    def resolve_dealer(self, dealer):
+        #Dealer makes decision: hit when below 17 and stand when above 16,
+        #or hit soft 17 too if the rules say so.
+        self.show_card(dealer[1])
+        state = dealer.state
+        if state >= DEALER_STANDS and (
+                state != DEALER_SOFT_17 or not self.rules.hit_soft_17):
+            return
+        
+        # The dealer has no choices to make, so the hand is played straight
+        # off the shoe with HAND_NEXT, without going through deal() for
+        # each card, and the cards are added to the hand and shown to the
+        # player all at once.
+        shoe = self.shoe
+        order = shoe.order
+        start = end = shoe.dealt
+        while True:
+            while state < DEALER_STANDS:
+                state = HAND_NEXT[state * 52 + order[end]]
+                end += 1
+            if state != DEALER_SOFT_17 or not self.rules.hit_soft_17:
+                break
+            state = HAND_NEXT[state * 52 + order[end]]
+            end += 1
+        shoe.dealt = end
+        
+        drawn = order[start:end]
+        dealer.add_indexes(drawn, state)
+        if self.batch_view:
+            self.revealed += drawn
+        else:
+            for index in drawn:
+                self.player_ai.view_card(CARDS[index])
+
+def save_checkpoint(path, sim, rounds_played):
+    # Saves everything needed to carry on the run exactly where it is: the
+    # simulator, with its shoe and RNG state, the AI and the statistics,
+    # and how far the records file had got. The file is written under
+    # another name and then renamed over the last checkpoint, so there's
+    # always a complete checkpoint even if the run is stopped halfway.
+    records = sim.records
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "rounds_played": rounds_played,
+        "sim": sim,
+        "records": records and (records.path, records.tell()),
+    }
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def load_checkpoint(path):
+    # Returns the simulator and the number of rounds played.
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    if not isinstance(state, dict) or state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} is not a checkpoint from this version")
+    
+    sim = state["sim"]
+    if state["records"]:
+        records_path, size = state["records"]
+        sim.records = RecordWriter(records_path, resume_at=size)
+    return sim, state["rounds_played"]
+
+CHECKPOINT_VERSION = 3
+
+class EdgeTable:
+    # The player's edge (the expected result per unit bet) and the variance
+    # of the result per unit bet at each true count (rounded down), for one
+    # AI, shoe and set of house rules, as measured by calibrate_edges.
+    # Counts beyond the outermost buckets with at least min_rounds rounds
+    # are looked up in those buckets.
+    
+    # The flat bet played to calibrate, big enough for the blackjack payout
+    # to come out whole.
+    UNIT = 100
+    
+    def __init__(self, key, buckets, min_rounds=10000):
+        # key: what the table was calibrated for (see edge_table_key).
+        # buckets: (rounds, edge, variance) by true count.
+        self.key = key
+        self.buckets = buckets
+        self.min_rounds = min_rounds
+        
+        counted = [tc for tc, (n, _, _) in buckets.items() if n >= min_rounds]
+        if not counted:
+            raise ValueError("not enough rounds at any true count to calibrate")
+        self.tc_min = min(counted)
+        self.tc_max = max(counted)
+        # Buckets with too few rounds in between use the nearest counted
+        # one, the one nearer 0 if two are as near.
+        self.edges = []
+        for tc in range(self.tc_min, self.tc_max + 1):
+            nearest = min(counted, key=lambda c: (abs(c - tc), abs(c)))
+            self.edges.append(buckets[nearest][1:])
+    
+    def lookup(self, true_count):
+        # The edge and variance per unit bet at true_count.
+        tc = min(max(math.floor(true_count), self.tc_min), self.tc_max)
+        return self.edges[tc - self.tc_min]
+    
+    @classmethod
+    def from_stats(cls, key, stats, min_rounds=10000):
+        # From the SimulationStats of a run at flat bets of UNIT.
+        return cls(key, {
+            tc: (s.n, s.mean / cls.UNIT, s.variance / cls.UNIT ** 2)
+            for tc, s in stats.by_count.items()}, min_rounds)
+    
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "key": self.key,
+                "min_rounds": self.min_rounds,
+                "buckets": [[tc, *bucket] for tc, bucket in sorted(self.buckets.items())],
+            }, f, indent=1)
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["key"],
+            {tc: (n, edge, variance) for tc, n, edge, variance in data["buckets"]},
+            data["min_rounds"])
+    
+    def report(self):
+        lines = ["Edge and variance per unit bet by true count:"]
+        for tc in sorted(self.buckets):
+            n, edge, variance = self.buckets[tc]
+            counted = self.tc_min <= tc <= self.tc_max and n >= self.min_rounds
+            lines.append(f"  {tc:+4}  {n:>10} rounds  {edge:+8.2%}  {variance:6.3f}"
+                f"{'' if counted else '  (too few rounds)'}")
+        return lines
+
+def edge_table_key(player_ai, num_decks, shuffle_deck_at, rules):
+    # Everything an EdgeTable depends on, as a dict that can be saved: how
+    # the AI counts and plays (its strategy table, by hash), the shoe and
+    # the house rules.
+    return {
+        "ai": type(player_ai).__name__,
+        "strategy": hashlib.sha256(player_ai.strategy.choices).hexdigest()[:16],
+        "counting_system": player_ai.counting_system.name,
+        "deck_resolution": player_ai.deck_resolution,
+        "fractional": player_ai.fractional,
+        "index_shift": player_ai.index_shift,
+        "num_decks": num_decks,
+        "shuffle_at": shuffle_deck_at,
+        "rules": str(rules or HouseRules()),
+    }
+
+# Where edge tables are cached, by the hash of their key.
+EDGE_TABLE_DIR = "edge_tables"
+
+def edge_table_path(key):
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return os.path.join(EDGE_TABLE_DIR, f"{digest[:16]}.json")
+
+class KellyBetting:
+    # Sizes bets by a fraction of the Kelly criterion: at a true count where
+    # the edge per unit bet is e and the variance v, the full Kelly bet is
+    # e / v of the bankroll. The bankroll is the starting bankroll plus the
+    # AI's profit. Without an edge the bet is the table minimum, and bets
+    # are whole amounts between the table minimum and maximum.
+    
+    def __init__(self, edge_table, bankroll=10000, fraction=0.5,
+            table_min=10, table_max=1000):
+        self.edge_table = edge_table
+        self.bankroll = bankroll
+        self.fraction = fraction
+        self.table_min = table_min
+        self.table_max = table_max
+    
+    def bet(self, true_count, funds):
+        edge, variance = self.edge_table.lookup(true_count)
+        bankroll = self.bankroll + funds
+        if edge <= 0 or bankroll <= 0:
+            return self.table_min
+        bet = int(self.fraction * edge / variance * bankroll)
+        return min(max(bet, self.table_min), self.table_max)
+
+def run_rounds(ai_type, num_rounds, num_decks=1, shuffle_deck_at=0.5,
+        seed=None, fast_shuffle=False, records_path=None, stats=False,
+        profile=False, rules=None):
+    # Entry point for --workers. Every worker gets its own simulator, AI
+    # and shoe, with a seed derived from the run's seed.
+    player_ai = ai_type()
+    records = RecordWriter(records_path) if records_path else None
+    stats = SimulationStats() if stats else None
+    sim = BlackjackSimulator(player_ai,
+        num_decks=num_decks, shuffle_deck_at=shuffle_deck_at, quiet=True,
+        rng=make_rng(seed, fast_shuffle), records=records, stats=stats,
+        rules=rules)
+    if profile:
+        sim.enable_profiling()
+    for _ in range(num_rounds):
+        sim.play_run()
+    if records:
+        records.close()
+    
+    return (player_ai.wins, player_ai.losses, player_ai.draws, player_ai.funds,
+        stats, sim.profiler)
+
+def run_parallel(ai_type, num_rounds, workers, num_decks=1, shuffle_deck_at=0.5,
+        seed=None, fast_shuffle=False, records_path=None, stats=False,
+        profile=False, rules=None):
+    # Worker i writes its records to records_path.i. Returns the total
+    # wins, losses, draws and funds, and the merged stats and profiles if
+    # asked for.
+    import multiprocessing
+    
+    # One chunk per worker, spreading the remainder over the first few.
+    chunks = [num_rounds // workers + (i < num_rounds % workers)
+        for i in range(workers)]
+    jobs = [
+        (ai_type, n, num_decks, shuffle_deck_at, derive_seed(seed, i), fast_shuffle,
+            f"{records_path}.{i}" if records_path else None, stats, profile, rules)
+        for i, n in enumerate(chunks) if n]
+    
+    # Nothing to play (no rounds) still gives zero totals and empty stats.
+    results = []
+    if jobs:
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.starmap(run_rounds, jobs)
+    
+    merged_stats = None
+    if stats:
+        merged_stats = SimulationStats()
+        for r in results:
+            merged_stats.merge(r[4])
+    
+    merged_profile = None
+    if profile:
+        merged_profile = Profiler()
+        for r in results:
+            merged_profile.merge(r[5])
+    
+    return (*(sum(r[i] for r in results) for i in range(4)),
+        merged_stats, merged_profile)
+
+def calibrate_edges(ai_type, num_rounds, num_decks=1, shuffle_deck_at=0.5,
+        rules=None, seed=None, fast_shuffle=False, workers=1, min_rounds=10000):
+    # Plays num_rounds at flat bets with a counting AI (ai_type) and returns
+    # the EdgeTable measured.
+    flat = functools.partial(ai_type,
+        bet_ramp=(0, 1, EdgeTable.UNIT, EdgeTable.UNIT))
+    if workers > 1:
+        stats = run_parallel(flat, num_rounds, workers, num_decks=num_decks,
+            shuffle_deck_at=shuffle_deck_at, seed=seed, fast_shuffle=fast_shuffle,
+            stats=True, rules=rules)[4]
+    else:
+        stats = run_rounds(flat, num_rounds, num_decks=num_decks,
+            shuffle_deck_at=shuffle_deck_at, seed=seed, fast_shuffle=fast_shuffle,
+            stats=True, rules=rules)[4]
+    key = edge_table_key(flat(), num_decks, shuffle_deck_at, rules)
+    return EdgeTable.from_stats(key, stats, min_rounds)
+
+def compare_ais(ai_types, num_shoes, num_decks=1, shuffle_deck_at=0.5,
+        seed=None, fast_shuffle=False, rules=None):
+    # Common random numbers: every shoe is shuffled once and played from
+    # the top by each AI until it would be reshuffled. Returns, for each
+    # AI, the number of rounds played and the list of profits per shoe.
+    dealer_shoe = Shoe(num_decks, make_rng(seed, fast_shuffle))
+    sims = [
+        BlackjackSimulator(ai_type(),
+            num_decks=num_decks, shuffle_deck_at=shuffle_deck_at, quiet=True,
+            shoe=ReplayShoe(dealer_shoe), rules=rules)
+        for ai_type in ai_types]
+    
+    rounds = [0] * len(sims)
+    profits = [[] for _ in sims]
+    
+    for _ in range(num_shoes):
+        dealer_shoe.shuffle()
+        
+        for i, sim in enumerate(sims):
+            sim.build_deck()
+            
+            funds = sim.player_ai.funds
+            while True:
+                sim.play_run()
+                rounds[i] += 1
+                if sim.needs_shuffle():
+                    break
+            profits[i].append(sim.player_ai.funds - funds)
+    
+    return rounds, profits
+
+def confidence_interval(samples, z=1.96):
+    # Mean and half-width of the (default 95%) confidence interval. With
+    # no samples, like RunningStats: 0 and an infinite interval.
+    if not samples:
+        return 0.0, float("inf")
+    mean = statistics.mean(samples)
+    if len(samples) < 2:
+        return mean, float("inf")
+    return mean, z * statistics.stdev(samples) / len(samples) ** 0.5
+
+def print_comparison(names, rounds, profits):
+    print(f"{'AI':20} {'Rounds':>10} {'Profit':>14}   Profit per shoe (95% CI)")
+    for name, n, shoe_profits in zip(names, rounds, profits):
+        mean, error = confidence_interval(shoe_profits)
+        print(f"{name:20} {n:>10} {sum(shoe_profits):>+14.0f}   {mean:+.2f} ± {error:.2f}")
+    
+    print()
+    print(f"Paired difference per shoe against {names[0]} (95% CI):")
+    for name, shoe_profits in zip(names[1:], profits[1:]):
+        mean, error = confidence_interval(
+            [a - b for a, b in zip(shoe_profits, profits[0])])
+        _, unpaired_error = confidence_interval(shoe_profits)
+        _, baseline_error = confidence_interval(profits[0])
+        unpaired_error = (unpaired_error ** 2 + baseline_error ** 2) ** 0.5
+        print(f"{name:20} {mean:+.2f} ± {error:.2f}"
+            f"   (± {unpaired_error:.2f} on independent shoes)")
 
 
 if __name__ == "__main__":
@@ -744,6 +2260,8 @@ if __name__ == "__main__":
     ai_type_group.add_argument("-ac", "--advanced_counting",
         help="use a riskier card-counting AI that deviates from basic strategy",
         dest="ai_type", action="store_const", const=PlayerAIAdvancedCardCount)
+    ai_type_group.add_argument("-t", "--table", metavar="FILE",
+        help="use a card-counting AI that plays by the strategy table in FILE")
     parser.set_defaults(ai_type=PlayerAICardCounting)
     
     parser.add_argument("-n", "--num-rounds",
@@ -758,24 +2276,273 @@ if __name__ == "__main__":
         help="sets the fraction of the cards that are dealt before shuffling (default 0.5)",
         dest="shuffle_at", metavar="FRAC",
         type=float, default=0.5)
+    parser.add_argument("--house-rules", metavar="CHANGES",
+        help="change the house rules, e.g. hit_soft_17=1,blackjack_pays=6:5"
+            " (see HouseRules for all of them)",
+        dest="house_rules", default="default")
     parser.add_argument("-q", "--quiet",
         help="remove most screen logging",
         action="store_true")
     parser.add_argument("-l", "--log", metavar="FILE",
         help="save logs to a file",
         nargs="?", const="log.txt")
+    parser.add_argument("--records", metavar="FILE",
+        help="save a binary record of every round to FILE (FILE.N for worker N)")
+    parser.add_argument("--stats",
+        help="show statistics on the profit per round and the bankroll at the end",
+        action="store_true")
+    parser.add_argument("--profile",
+        help="time the simulator's phases and the AI's callbacks and show a summary at the end",
+        action="store_true")
+    parser.add_argument("-w", "--workers",
+        help="split the rounds over NUM processes (requires --quiet)",
+        dest="workers", metavar="NUM",
+        type=int, default=1)
+    parser.add_argument("--compare", metavar="AI", nargs="+",
+        help="play every shoe with each of the given AIs and compare them"
+            f" (-n sets the number of shoes), AIs are: {', '.join(AI_TYPES)}",
+        choices=AI_TYPES)
+    parser.add_argument("--seed",
+        help="seed the shuffles, so the run can be repeated exactly",
+        type=int)
+    parser.add_argument("--fast-shuffle",
+        help="shuffle with NumPy, which is faster for large shoes (results differ from the default shuffle)",
+        dest="fast_shuffle", action="store_true")
+    parser.add_argument("--deck-resolution",
+        help="estimate the decks left for the true count in whole decks (default), half decks,"
+            " or exactly (card counting AIs only)",
+        dest="deck_resolution", choices=PlayerAICardCounting.DECK_RESOLUTIONS)
+    parser.add_argument("--fractional-count",
+        help="don't round the true count down to a whole number (card counting AIs only)",
+        dest="fractional_count", action="store_true")
+    parser.add_argument("--count-system", metavar="NAME",
+        help="count cards with NAME instead of Hi-Lo (card counting AIs only),"
+            f" one of: {', '.join(COUNTING_SYSTEMS)}",
+        dest="count_system", choices=COUNTING_SYSTEMS)
+    parser.add_argument("--side-counts", metavar="NAME", nargs="+",
+        help="also keep these counts, and compare them with --stats (card counting AIs only)",
+        dest="side_counts", choices=COUNTING_SYSTEMS)
+    parser.add_argument("--seed-per-shoe",
+        help="shuffle each shoe with its own seed, derived from --seed (results differ from"
+            " the default shuffle, but not with --producer)",
+        dest="seed_per_shoe", action="store_true")
+    parser.add_argument("--producer",
+        help="shuffle the next shoes ahead of time in another process (implies --seed-per-shoe)",
+        action="store_true")
+    parser.add_argument("--kelly", metavar="FRACTION",
+        help="size the bets by this fraction of the Kelly criterion, from the edge at each"
+            " true count (card counting AIs only, see --edge-table)",
+        type=float)
+    parser.add_argument("--bankroll",
+        help="set the starting bankroll for --kelly and the risk of ruin in --stats (default 10000)",
+        metavar="NUM", type=int, default=10000)
+    parser.add_argument("--table-min",
+        help="set the table minimum bet for --kelly (default 10)",
+        dest="table_min", metavar="NUM", type=int, default=10)
+    parser.add_argument("--table-max",
+        help="set the table maximum bet for --kelly (default 1000)",
+        dest="table_max", metavar="NUM", type=int, default=1000)
+    parser.add_argument("--edge-table", metavar="FILE",
+        help="the edge table for --kelly, calibrated and saved there if it doesn't exist"
+            f" (default: one per AI, shoe and house rules, kept in {EDGE_TABLE_DIR}/)",
+        dest="edge_table")
+    parser.add_argument("--calibration-rounds",
+        help="set the number of rounds played to calibrate an edge table (default 2000000)",
+        dest="calibration_rounds", metavar="NUM",
+        type=int, default=2000000)
+    parser.add_argument("--recalibrate",
+        help="calibrate the edge table for --kelly again, even if it's been saved",
+        action="store_true")
+    parser.add_argument("--checkpoint", metavar="FILE",
+        help="save the state of the run to FILE every --checkpoint-every rounds (requires --quiet)")
+    parser.add_argument("--checkpoint-every",
+        help="set the number of rounds between checkpoints (default 1000000)",
+        dest="checkpoint_every", metavar="NUM",
+        type=int, default=1000000)
+    parser.add_argument("--resume",
+        help="carry on the run saved in the --checkpoint file, up to -n rounds in all"
+            " (the other options are taken from the checkpoint)",
+        action="store_true")
     args = parser.parse_args()
     
+    try:
+        rules = HouseRules.parse(args.house_rules)
+    except ValueError as e:
+        parser.error(f"--house-rules: {e}")
+    
+    count_options = {}
+    if args.count_system is not None:
+        count_options["counting_system"] = COUNTING_SYSTEMS[args.count_system]
+    if args.side_counts:
+        count_options["side_systems"] = [COUNTING_SYSTEMS[name]
+            for name in args.side_counts]
+    if args.deck_resolution is not None:
+        count_options["deck_resolution"] = (
+            PlayerAICardCounting.DECK_RESOLUTIONS[args.deck_resolution])
+    if args.fractional_count:
+        count_options["fractional"] = True
+    
+    def with_count_options(ai_type):
+        if count_options and issubclass(ai_type, PlayerAICardCounting):
+            return functools.partial(ai_type, **count_options)
+        return ai_type
+    
+    if args.table:
+        try:
+            StrategyTable.load(args.table)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        args.ai_type = functools.partial(PlayerAITable, args.table, **count_options)
+    elif count_options and not args.compare:
+        if not issubclass(args.ai_type, PlayerAICardCounting):
+            parser.error("the counting options need a card counting AI")
+        args.ai_type = with_count_options(args.ai_type)
+    
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1:
+        if not args.quiet:
+            parser.error("--workers requires --quiet")
+        if args.log is not None:
+            parser.error("--workers cannot be combined with --log")
+        if args.ai_type is PlayerAIManual:
+            parser.error("--workers cannot be used with a manual player")
+    
+    if args.producer or args.seed_per_shoe:
+        if args.workers > 1 or args.compare:
+            parser.error("--seed-per-shoe and --producer cannot be used with --workers or --compare")
+    
+    if args.resume and not args.checkpoint:
+        parser.error("--resume requires --checkpoint")
+    if args.checkpoint:
+        if not args.quiet:
+            parser.error("--checkpoint requires --quiet")
+        for option, value in (("--log", args.log is not None),
+                ("--profile", args.profile), ("--workers", args.workers > 1),
+                ("--compare", args.compare), ("a manual player", args.ai_type is PlayerAIManual)):
+            if value:
+                parser.error(f"--checkpoint cannot be used with {option}")
+        if args.checkpoint_every < 1:
+            parser.error("--checkpoint-every must be at least 1")
+    
+    if args.fast_shuffle:
+        try:
+            import numpy
+        except ImportError:
+            parser.error("--fast-shuffle requires NumPy")
+    
+    if args.kelly is not None and not args.resume:
+        if args.compare:
+            parser.error("--kelly cannot be used with --compare")
+        if args.kelly <= 0:
+            parser.error("--kelly must be above 0")
+        if not 0 < args.table_min <= args.table_max:
+            parser.error("the table minimum must be above 0 and at most the table maximum")
+        
+        player_ai = args.ai_type()
+        if not isinstance(player_ai, PlayerAICardCounting):
+            parser.error("--kelly needs a card counting AI")
+        key = edge_table_key(player_ai, args.num_decks, args.shuffle_at, rules)
+        edge_table_file = args.edge_table or edge_table_path(key)
+        
+        edge_table = None
+        if os.path.exists(edge_table_file) and not args.recalibrate:
+            try:
+                edge_table = EdgeTable.load(edge_table_file)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                parser.error(f"can't read the edge table {edge_table_file}: {e}")
+            if edge_table.key != key:
+                parser.error(f"{edge_table_file} was calibrated for other settings"
+                    " (--recalibrate replaces it)")
+        if edge_table is None:
+            print(f"Calibrating the edge table ({args.calibration_rounds} rounds)...")
+            try:
+                edge_table = calibrate_edges(args.ai_type, args.calibration_rounds,
+                    num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+                    rules=rules, seed=derive_seed(args.seed, "calibration"),
+                    fast_shuffle=args.fast_shuffle, workers=args.workers)
+            except ValueError as e:
+                parser.error(f"can't calibrate: {e} (try more --calibration-rounds)")
+            edge_table.save(edge_table_file)
+            print(*edge_table.report(), sep="\n")
+            print(f"Saved to {edge_table_file}")
+            print("----------------------------------")
+        
+        args.ai_type = functools.partial(args.ai_type, bet_policy=KellyBetting(
+            edge_table, bankroll=args.bankroll, fraction=args.kelly,
+            table_min=args.table_min, table_max=args.table_max))
+    
+    if args.compare:
+        if len(args.compare) < 2:
+            parser.error("--compare needs at least two AIs")
+        for option, value in (("--records", args.records), ("--stats", args.stats),
+                ("--profile", args.profile), ("--log", args.log is not None),
+                ("--workers", args.workers > 1)):
+            if value:
+                parser.error(f"--compare cannot be used with {option}")
+        rounds, profits = compare_ais(
+            [with_count_options(AI_TYPES[name]) for name in args.compare],
+            args.num_rounds,
+            num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+            seed=args.seed, fast_shuffle=args.fast_shuffle, rules=rules)
+        print_comparison(args.compare, rounds, profits)
+        sys.exit()
+    
+    if args.workers > 1:
+        wins, losses, draws, funds, stats, profiler = run_parallel(args.ai_type,
+            args.num_rounds, args.workers,
+            num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+            seed=args.seed, fast_shuffle=args.fast_shuffle,
+            records_path=args.records, stats=args.stats, profile=args.profile,
+            rules=rules)
+        
+        print("Player Wins:  ", wins)
+        print("Player Losses:", losses)
+        print("Player Draws: ", draws)
+        print(f"Profit:        {funds:+}")
+        if stats:
+            print("----------------------------------")
+            print(*stats.report(args.bankroll), sep="\n")
+        if profiler:
+            print("----------------------------------")
+            print(*profiler.report(), sep="\n")
+        sys.exit()
+    
     
     if args.log is None:
         log_file = None
     else:
         log_file = open(args.log, "w", encoding="utf-8")
     
-    player_ai = args.ai_type()
-    sim = BlackjackSimulator(player_ai,
-        num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
-        quiet=args.quiet, log_file=log_file)
+    if args.resume:
+        try:
+            sim, first_round = load_checkpoint(args.checkpoint)
+        except (OSError, ValueError, pickle.UnpicklingError) as e:
+            parser.error(f"can't resume from {args.checkpoint}: {e}")
+        player_ai = sim.player_ai
+        records = sim.records
+        stats = sim.stats
+        if args.producer and not isinstance(sim.shoe, SeededShoe):
+            parser.error("--producer can't be used to resume a run without --seed-per-shoe")
+    else:
+        records = RecordWriter(args.records) if args.records else None
+        stats = SimulationStats() if args.stats else None
+        
+        shoe = None
+        if args.producer or args.seed_per_shoe:
+            shoe = SeededShoe(args.num_decks, args.seed, args.fast_shuffle)
+        
+        player_ai = args.ai_type()
+        sim = BlackjackSimulator(player_ai,
+            num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+            quiet=args.quiet, log_file=log_file,
+            rng=make_rng(args.seed, args.fast_shuffle), records=records, stats=stats,
+            shoe=shoe, rules=rules)
+        if args.profile:
+            sim.enable_profiling()
+        first_round = 0
+    
+    checkpoint_every = args.checkpoint_every if args.checkpoint else 0
     
     if args.quiet and args.num_rounds >= 100000:
         thousands_of_rounds = str(args.num_rounds // 1000)
@@ -784,23 +2551,46 @@ if __name__ == "__main__":
         occ_update = None
     
     #Run the simulation
-    for run_number in range(args.num_rounds):
-        
-        if occ_update and run_number % 50000 == 49999:
-            print(occ_update.format((run_number + 1) // 1000))
-        
-        sim.print("----------------------------------")
-        sim.play_run()
-        sim.print(f"Total Profit: {player_ai.funds:+}")
+    # The producer is stopped and its shared memory freed however the run
+    # ends, including on Ctrl+C.
+    if args.producer:
+        sim.shoe.start_producer()
+    try:
+        for run_number in range(first_round, args.num_rounds):
+            
+            if occ_update and run_number % 50000 == 49999:
+                print(occ_update.format((run_number + 1) // 1000))
+            
+            if sim.verbose:
+                sim.print("----------------------------------")
+            sim.play_run()
+            if sim.verbose:
+                sim.print(f"Total Profit: {player_ai.funds:+}")
+            
+            if checkpoint_every and (run_number + 1) % checkpoint_every == 0:
+                save_checkpoint(args.checkpoint, sim, run_number + 1)
+    finally:
+        if isinstance(sim.shoe, SeededShoe):
+            sim.shoe.stop_producer()
     
     sim.print("----------------------------------")
     sim.print("Player Wins:  ", player_ai.wins,      loud=True)
     sim.print("Player Losses:", player_ai.losses,    loud=True)
     sim.print("Player Draws: ", player_ai.draws,     loud=True)
     sim.print(f"Profit:        {player_ai.funds:+}", loud=True)
+    if stats:
+        sim.print("----------------------------------", loud=True)
+        for line in stats.report(args.bankroll):
+            sim.print(line, loud=True)
+    if sim.profiler:
+        sim.print("----------------------------------", loud=True)
+        for line in sim.profiler.report():
+            sim.print(line, loud=True)
     
     if log_file:
         log_file.close()
+    if records:
+        records.close()
 
 
 
@@ -0,0 +1,411 @@
+import asyncio
+import concurrent.futures
+import json
+import math
+import types
+
+import main
+
+#Plays simulated tables for AIs ("agents") that run in other processes.
+#Run the server with `python server.py`, and connect an agent to it; see
+#`python server.py --help` for options. `python server.py --local-agent AI`
+#starts a stand-in agent too, which plays one of main.py's AIs through the
+#server, and stops when it's done.
+#
+#Protocol: the agent connects over TCP and both sides send JSON objects,
+#one per line. The agent starts with {"agent": NAME}. The server then plays
+#a number of tables for it at once, each in its own thread with its own
+#BlackjackSimulator and shoe, and sends the decisions the tables are
+#waiting on, batched:
+#   {"requests": [REQUEST, ...]}
+#The agent answers all of them in one message:
+#   {"replies": [[ID, ANSWER], ...]}
+#Each REQUEST is an object with:
+#   id          the ID to answer with
+#   table       the table it's from (0, 1, ...)
+#   kind        "bet", "insurance", "surrender" or "choice"
+#   dealt       the number of cards dealt from the table's shoe so far
+#   shuffled    (if the shoe was shuffled since the table's last request)
+#               the number of decks in the new shoe
+#   seen        (if any) the cards the agent saw since its last request at
+#               this table, as card indexes (see main.CARDS)
+#   results     (if any) the results of the rounds finished since then, as
+#               PlayerAI.end_round gets them
+#   upcard      the dealer's upcard, except for bets
+#   hand        the cards of the hand to decide on, except for bets
+#   times_split how many times the hand was split, for choices
+#and is answered with the bet, true/false, or one of the PlayerAI.CH_*
+#choices. Requests are sent once every table that's still playing is
+#waiting on one, or after --max-delay seconds. When all the tables have
+#played their rounds, the server sends {"done": {"tables": [[WINS, LOSSES,
+#DRAWS, FUNDS], ...]}} and closes the connection. Bets have to be positive
+#numbers, and a split is only allowed for a hand that can be split. A
+#reply that breaks the protocol ends the agent's session, and only its
+#session.
+
+class AgentError(Exception):
+    # The agent broke the protocol or went away.
+    pass
+
+class RemotePlayerAI(main.PlayerAI):
+    # The stand-in for the agent at a table. Cards, shuffles and results
+    # are saved up and sent along with the table's next request.
+
+    batch_view = True
+
+    def __init__(self, session, table):
+        super().__init__()
+        self.session = session
+        self.table = table
+        self.shoe = None
+        self.shuffled = None
+        self.seen = bytearray()
+        self.results = []
+
+    def deck_shuffled(self, shoe):
+        self.shoe = shoe
+        self.shuffled = shoe.num_decks
+        self.seen.clear()
+
+    def view_cards(self, cards):
+        self.seen += cards
+
+    def end_round(self, result):
+        super().end_round(result)
+        self.results.append(result)
+
+    def ask(self, kind, **fields):
+        request = {"table": self.table, "kind": kind, "dealt": self.shoe.dealt}
+        if self.shuffled is not None:
+            request["shuffled"] = self.shuffled
+            self.shuffled = None
+        if self.seen:
+            request["seen"] = list(self.seen)
+            self.seen.clear()
+        if self.results:
+            request["results"] = self.results
+            self.results = []
+        request.update(fields)
+        return self.session.ask(request)
+
+    def hand_fields(self, hand):
+        return {"upcard": self.dealer_hand.buffer[0], "hand": list(hand.buffer)}
+
+    def make_bet(self):
+        bet = self.ask("bet")
+        if type(bet) not in (int, float) or not (math.isfinite(bet) and bet > 0):
+            raise AgentError(f"invalid bet {bet!r}")
+        return bet
+
+    def ask_yes_no(self, kind):
+        answer = self.ask(kind, **self.hand_fields(self.my_hands[0]))
+        if type(answer) is not bool:
+            raise AgentError(f"invalid answer {answer!r} to {kind}")
+        return answer
+
+    def choose_insurance(self):
+        return self.ask_yes_no("insurance")
+
+    def choose_surrender(self):
+        return self.ask_yes_no("surrender")
+
+    def choice(self, my_hand):
+        choice = self.ask("choice", times_split=my_hand.times_split,
+            **self.hand_fields(my_hand))
+        if type(choice) is not int or not 0 <= choice < len(self.choice_names):
+            raise AgentError(f"invalid choice {choice!r}")
+        if choice == self.CH_SPLIT and not my_hand.can_be_split():
+            raise AgentError("split of a hand that can't be split")
+        return choice
+
+class AgentSession:
+    # One connected agent and its tables. The tables run in threads and
+    # block in ask() while the event loop collects their requests and
+    # sends them out in batches.
+
+    def __init__(self, loop, writer, num_tables, max_delay):
+        self.loop = loop
+        self.writer = writer
+        self.live = num_tables
+        self.max_delay = max_delay
+        self.pending = []
+        self.waiting = {}
+        self.next_id = 0
+        self.timer = None
+        # Why the session failed, once it has; later requests fail with it
+        self.error = None
+
+    def ask(self, request):
+        # Called from a table's thread. Fails straight away once the
+        # session has, without waiting on the event loop.
+        if self.error is not None:
+            raise AgentError(self.error)
+        future = concurrent.futures.Future()
+        self.loop.call_soon_threadsafe(self.submit, request, future)
+        return future.result()
+
+    def submit(self, request, future):
+        if self.error is not None:
+            future.set_exception(AgentError(self.error))
+            return
+        request["id"] = self.next_id
+        self.waiting[self.next_id] = future
+        self.next_id += 1
+        self.pending.append(request)
+        self.maybe_send()
+
+    def table_done(self):
+        self.live -= 1
+        self.maybe_send()
+
+    def maybe_send(self):
+        if not self.pending:
+            return
+        if len(self.pending) >= self.live:
+            self.send()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.max_delay, self.send)
+
+    def send(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.pending:
+            write_message(self.writer, {"requests": self.pending})
+            self.pending = []
+
+    def answer(self, replies):
+        # The answers are checked by the tables (see RemotePlayerAI).
+        if type(replies) is not list:
+            raise AgentError("replies must be a list")
+        for reply in replies:
+            if type(reply) is not list or len(reply) != 2 or type(reply[0]) is not int:
+                raise AgentError(f"invalid reply {reply!r}")
+            request_id, answer = reply
+            future = self.waiting.pop(request_id, None)
+            if future is None:
+                raise AgentError(f"reply to unknown request {request_id}")
+            future.set_result(answer)
+
+    def fail(self, error):
+        # The agent is gone or broke the protocol; the tables waiting on it
+        # stop with error, a message.
+        self.error = error
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for future in self.waiting.values():
+            future.set_exception(AgentError(error))
+        self.waiting.clear()
+        self.pending = []
+
+def write_message(writer, message):
+    writer.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+
+async def read_message(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    return json.loads(line)
+
+def play_table(session, table, num_rounds, num_decks, shuffle_deck_at, seed):
+    # A table's thread. Returns the agent's wins, losses, draws and funds.
+    player_ai = RemotePlayerAI(session, table)
+    sim = main.BlackjackSimulator(player_ai,
+        num_decks=num_decks, shuffle_deck_at=shuffle_deck_at, quiet=True,
+        rng=main.derive_seed(seed, table))
+    try:
+        for _ in range(num_rounds):
+            sim.play_run()
+    finally:
+        session.loop.call_soon_threadsafe(session.table_done)
+    return player_ai.wins, player_ai.losses, player_ai.draws, player_ai.funds
+
+class TableServer:
+    def __init__(self, num_tables, num_rounds, num_decks=1, shuffle_deck_at=0.5,
+            seed=None, max_delay=0.001):
+        self.num_tables = num_tables
+        self.num_rounds = num_rounds
+        self.num_decks = num_decks
+        self.shuffle_deck_at = shuffle_deck_at
+        self.seed = seed
+        self.max_delay = max_delay
+
+    async def serve_agent(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            name = (await read_message(reader))["agent"]
+        except (ConnectionError, ValueError, KeyError, TypeError):
+            writer.close()
+            return
+
+        session = AgentSession(loop, writer, self.num_tables, self.max_delay)
+        executor = concurrent.futures.ThreadPoolExecutor(self.num_tables)
+        tables = [
+            loop.run_in_executor(executor, play_table, session, table,
+                self.num_rounds, self.num_decks, self.shuffle_deck_at, self.seed)
+            for table in range(self.num_tables)]
+        # The threads finish on their own; the loop mustn't block on them.
+        executor.shutdown(wait=False)
+
+        async def read_replies():
+            while True:
+                message = await read_message(reader)
+                if type(message) is not dict or "replies" not in message:
+                    raise AgentError("expected replies")
+                session.answer(message["replies"])
+
+        # Any error from the reader or a table ends the session.
+        reading = asyncio.ensure_future(read_replies())
+        running = {*tables, reading}
+        error = None
+        while error is None and not all(table.done() for table in tables):
+            done, running = await asyncio.wait(running,
+                return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    break
+        reading.cancel()
+
+        if error is None:
+            results = [table.result() for table in tables]
+            write_message(writer, {"done": {"tables": results}})
+            print(f"{name}: {summary(results)}")
+        else:
+            if isinstance(error, ConnectionError):
+                error = f"agent {name} disconnected"
+            else:
+                error = f"agent {name} failed: {error or type(error).__name__}"
+            session.fail(error)
+            await asyncio.gather(*tables, return_exceptions=True)
+            print(error)
+        writer.close()
+
+def summary(results):
+    wins, losses, draws, funds = (sum(r[i] for r in results) for i in range(4))
+    return (f"{len(results)} tables, {wins} wins, {losses} losses,"
+        f" {draws} draws, profit {funds:+}")
+
+class MirrorAgent:
+    # The stand-in agent: plays one of main.py's AIs at each table by
+    # keeping a copy of the AI per table up to date with what it's sent.
+
+    def __init__(self, ai_type):
+        self.ai_type = ai_type
+        self.tables = {}
+
+    def answer(self, request):
+        table = self.tables.get(request["table"])
+        if table is None:
+            table = self.tables[request["table"]] = types.SimpleNamespace(
+                ai=self.ai_type(), shoe=types.SimpleNamespace(num_decks=1, dealt=0))
+        ai = table.ai
+
+        if "shuffled" in request:
+            table.shoe = types.SimpleNamespace(num_decks=request["shuffled"], dealt=0)
+            ai.deck_shuffled(table.shoe)
+        for result in request.get("results", ()):
+            ai.my_hands = ()
+            ai.dealer_hand = None
+            ai.end_round(result)
+        table.shoe.dealt = request["dealt"]
+        if "seen" in request:
+            ai.view_cards(bytes(request["seen"]))
+
+        kind = request["kind"]
+        if kind == "bet":
+            return ai.make_bet()
+
+        ai.dealer_hand = main.Hand("Dealer", main.CARDS[request["upcard"]])
+        hand = main.Hand("Player", *(main.CARDS[i] for i in request["hand"]),
+            times_split=request.get("times_split", 0))
+        ai.my_hands = [hand]
+        if kind == "insurance":
+            return ai.choose_insurance()
+        if kind == "surrender":
+            return ai.choose_surrender()
+        return ai.choice(hand)
+
+    async def play(self, host, port, name):
+        # Returns what the server sent when it was done.
+        reader, writer = await asyncio.open_connection(host, port)
+        write_message(writer, {"agent": name})
+        try:
+            while True:
+                message = await read_message(reader)
+                if "done" in message:
+                    return message["done"]
+                write_message(writer, {"replies": [
+                    [request["id"], self.answer(request)]
+                    for request in message["requests"]]})
+                await writer.drain()
+        finally:
+            writer.close()
+
+async def serve(server, host, port, local_agent=None):
+    tcp_server = await asyncio.start_server(server.serve_agent, host, port)
+    print("Serving on", ", ".join(
+        str(s.getsockname()) for s in tcp_server.sockets))
+    async with tcp_server:
+        if local_agent is None:
+            await tcp_server.serve_forever()
+        else:
+            port = tcp_server.sockets[0].getsockname()[1]
+            await MirrorAgent(main.AI_TYPES[local_agent]).play(host, port, local_agent)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host",
+        help="the address to listen on (default 127.0.0.1)",
+        default="127.0.0.1")
+    parser.add_argument("--port",
+        help="the port to listen on (default 8765, 0 for any free port)",
+        type=int, default=8765)
+    parser.add_argument("--tables",
+        help="set the number of tables played at once for each agent (default 16)",
+        metavar="NUM", type=int, default=16)
+    parser.add_argument("-n", "--num-rounds",
+        help="set the number of rounds to play at each table (default 1000)",
+        dest="num_rounds", metavar="NUM",
+        type=int, default=1000)
+    parser.add_argument("-d", "--num-decks",
+        help="set the number of decks to play with (default 1)",
+        dest="num_decks", metavar="NUM",
+        type=int, default=1)
+    parser.add_argument("-sh", "--shuffle-at",
+        help="sets the fraction of the cards that are dealt before shuffling (default 0.5)",
+        dest="shuffle_at", metavar="FRAC",
+        type=float, default=0.5)
+    parser.add_argument("--seed",
+        help="seed the shuffles (table N uses a seed derived from it and N)",
+        type=int)
+    parser.add_argument("--max-delay",
+        help="the longest a decision waits for the other tables' before it's sent"
+            " (default 0.001 s)",
+        dest="max_delay", metavar="SECONDS",
+        type=float, default=0.001)
+    parser.add_argument("--local-agent", metavar="AI",
+        help=f"play one agent, a stand-in that plays one of: {', '.join(main.AI_TYPES)}",
+        dest="local_agent", choices=main.AI_TYPES)
+    args = parser.parse_args()
+
+    if args.tables < 1:
+        parser.error("--tables must be at least 1")
+
+    server = TableServer(args.tables, args.num_rounds,
+        num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+        seed=args.seed, max_delay=args.max_delay)
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.local_agent))
+    except KeyboardInterrupt:
+        pass
+    if args.local_agent:
+        elapsed = time.perf_counter() - start
+        print(f"({args.tables * args.num_rounds / elapsed:.0f} rounds/s)")
@@ -0,0 +1,169 @@
+import functools
+import itertools
+import multiprocessing
+
+import main
+
+#Searches a grid of betting and playing parameters for the most profitable.
+#Run it with `python sweep.py`, see `python sweep.py --help` for options.
+#
+#Every combination of the values given for each parameter is a
+#configuration:
+#   num_decks    the number of decks in the shoe
+#   shuffle_at   the fraction of the cards dealt before shuffling
+#   ramp_low     the true count at which the AI starts raising its bet
+#   ramp_high    the true count at which the AI bets the maximum
+#   min_bet      the bet at ramp_low and below
+#   max_bet      the bet at ramp_high and above
+#   index_shift  how much higher the AI's deviation indexes are than usual
+#                (see PlayerAICardCounting.__init__)
+#
+#The configurations are played in batches of rounds over a pool of
+#processes. Batch k is played with the same seed in every configuration, so
+#configurations with the same shoe see the same cards. After each batch,
+#a configuration is dropped when the top of the confidence interval of its
+#EV per round is below the bottom of the best configuration's, and the
+#sweep goes on with the others.
+
+PARAMETERS = ("num_decks", "shuffle_at", "ramp_low", "ramp_high",
+    "min_bet", "max_bet", "index_shift")
+
+def configurations(grid):
+    # Every combination of the values in grid (a list of values for each of
+    # PARAMETERS), as a list of dicts.
+    return [dict(zip(PARAMETERS, values))
+        for values in itertools.product(*(grid[name] for name in PARAMETERS))]
+
+def run_batch(ai_type, config, num_rounds, seed):
+    # Plays a batch with one configuration. Returns the RunningStats of the
+    # profit per round.
+    player_ai_type = functools.partial(ai_type,
+        bet_ramp=(config["ramp_low"], config["ramp_high"],
+            config["min_bet"], config["max_bet"]),
+        index_shift=config["index_shift"])
+    stats = main.run_rounds(player_ai_type, num_rounds,
+        num_decks=config["num_decks"], shuffle_deck_at=config["shuffle_at"],
+        seed=seed, stats=True)[4]
+    return stats.rounds
+
+def sweep(ai_type, grid, batch_rounds, max_batches, min_batches=2,
+        workers=None, seed=0, progress=None):
+    # Returns the configurations, the RunningStats of each, and the number
+    # of batches after which each was dropped (None if it never was).
+    # progress, if given, is called after every batch with the batch number
+    # and the number of configurations still running.
+    configs = configurations(grid)
+    results = [main.RunningStats() for _ in configs]
+    dropped = [None] * len(configs)
+
+    with multiprocessing.Pool(workers) as pool:
+        for batch in range(max_batches):
+            live = [i for i, d in enumerate(dropped) if d is None]
+            if len(live) < 2 and batch >= min_batches:
+                break
+
+            jobs = [(ai_type, configs[i], batch_rounds, main.derive_seed(seed, batch))
+                for i in live]
+            for i, stats in zip(live, pool.starmap(run_batch, jobs)):
+                results[i].merge(stats)
+
+            if batch + 1 >= min_batches:
+                best_low = max(results[i].mean - results[i].error for i in live)
+                for i in live:
+                    if results[i].mean + results[i].error < best_low:
+                        dropped[i] = batch + 1
+
+            if progress:
+                progress(batch + 1, sum(d is None for d in dropped))
+
+    return configs, results, dropped
+
+def print_results(configs, results, dropped):
+    print(f"{'decks':>5} {'shuffle':>7} {'ramp':>9} {'bets':>15} {'shift':>5}"
+        f" {'rounds':>10}   {'EV per round (95% CI)':24} dropped")
+    order = sorted(range(len(configs)), key=lambda i: results[i].mean, reverse=True)
+    for i in order:
+        c = configs[i]
+        ev = f"{results[i].mean:+.3f} ± {results[i].error:.3f}"
+        print(f"{c['num_decks']:>5} {c['shuffle_at']:>7}"
+            f" {c['ramp_low']:>+4}..{c['ramp_high']:<+3}"
+            f" {c['min_bet']:>7}..{c['max_bet']:<6} {c['index_shift']:>+5}"
+            f" {results[i].n:>10}   {ev:24}"
+            f" {'' if dropped[i] is None else f'after {dropped[i]}'}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+
+    ai_type_group = parser.add_mutually_exclusive_group()
+    ai_type_group.add_argument("-c", "--counting",
+        help="tune the card counting AI",
+        dest="ai_type", action="store_const", const=main.PlayerAICardCounting)
+    ai_type_group.add_argument("-ac", "--advanced_counting",
+        help="tune the card counting AI that deviates from basic strategy (default)",
+        dest="ai_type", action="store_const", const=main.PlayerAIAdvancedCardCount)
+    parser.set_defaults(ai_type=main.PlayerAIAdvancedCardCount)
+
+    parser.add_argument("-d", "--num-decks",
+        help="the numbers of decks to try (default 1)",
+        dest="num_decks", metavar="NUM", nargs="+",
+        type=int, default=[1])
+    parser.add_argument("-sh", "--shuffle-at",
+        help="the shuffle points to try (default 0.5)",
+        dest="shuffle_at", metavar="FRAC", nargs="+",
+        type=float, default=[0.5])
+    parser.add_argument("--ramp-low",
+        help="the true counts to start raising the bet at (default 0)",
+        dest="ramp_low", metavar="TC", nargs="+",
+        type=int, default=[0])
+    parser.add_argument("--ramp-high",
+        help="the true counts to bet the maximum at (default 10)",
+        dest="ramp_high", metavar="TC", nargs="+",
+        type=int, default=[10])
+    parser.add_argument("--min-bet",
+        help="the minimum bets to try (default 10)",
+        dest="min_bet", metavar="BET", nargs="+",
+        type=int, default=[10])
+    parser.add_argument("--max-bet",
+        help="the maximum bets to try (default 10000)",
+        dest="max_bet", metavar="BET", nargs="+",
+        type=int, default=[10000])
+    parser.add_argument("--index-shift",
+        help="the shifts of the deviation indexes to try (default 0)",
+        dest="index_shift", metavar="TC", nargs="+",
+        type=int, default=[0])
+    parser.add_argument("-n", "--batch-rounds",
+        help="set the number of rounds per batch (default 20000)",
+        dest="batch_rounds", metavar="NUM",
+        type=int, default=20000)
+    parser.add_argument("--max-batches",
+        help="stop after NUM batches (default 10)",
+        dest="max_batches", metavar="NUM",
+        type=int, default=10)
+    parser.add_argument("--min-batches",
+        help="don't drop any configuration before NUM batches (default 2)",
+        dest="min_batches", metavar="NUM",
+        type=int, default=2)
+    parser.add_argument("-w", "--workers",
+        help="the number of processes (default one per CPU)",
+        dest="workers", metavar="NUM",
+        type=int)
+    parser.add_argument("--seed",
+        help="seed the shuffles (default 0)",
+        type=int, default=0)
+    args = parser.parse_args()
+
+    for low, high in itertools.product(args.ramp_low, args.ramp_high):
+        if low >= high:
+            parser.error(f"--ramp-low {low} is not below --ramp-high {high}")
+
+    grid = {name: getattr(args, name) for name in PARAMETERS}
+
+    def progress(batch, live):
+        print(f"Batch {batch}/{args.max_batches}: {live} configurations left")
+
+    print_results(*sweep(args.ai_type, grid, args.batch_rounds, args.max_batches,
+        min_batches=args.min_batches, workers=args.workers, seed=args.seed,
+        progress=progress))
@@ -0,0 +1,289 @@
+import main
+
+#Simulates a table with several seats, each played by its own AI, all dealt
+#from one shoe against one dealer.
+#Run it with `python table.py counting rules`, see `python table.py --help`
+#for options.
+#
+#The house rules and payouts are the same as BlackjackSimulator's, and can
+#be changed the same way (see main.HouseRules). Every
+#seat sees every card that is dealt face up, at any seat, so a counting AI
+#counts the other seats' cards too. The dealer's hand is played once per
+#round for all the seats, and the hole card is always turned over at the
+#end of the round.
+
+MAX_SEATS = 7
+
+class Seat:
+    def __init__(self, name, player_ai, stats=None):
+        self.name = name
+        self.player_ai = player_ai
+        # SimulationStats for this seat, or None
+        self.stats = stats
+        # The profit per round
+        self.rounds = main.RunningStats()
+        # How many of the table's revealed cards the AI has been given
+        self.seen = 0
+
+class TableSimulator(main.BlackjackSimulator):
+    # Seats take their turns in order. While a seat is playing, player_ai
+    # is its AI, so the single player methods (play_hand and the
+    # messages) work on it unchanged.
+
+    def __init__(self, player_ais, num_decks=1, shuffle_deck_at=0.5,
+            log_file=None, rng=None, stats=False, rules=None):
+        if not 1 <= len(player_ais) <= MAX_SEATS:
+            raise ValueError(f"a table has 1 to {MAX_SEATS} seats")
+        self.seats = [
+            Seat(f"Seat {n}", player_ai, main.SimulationStats() if stats else None)
+            for n, player_ai in enumerate(player_ais, 1)]
+        self.seat = self.seats[0]
+
+        super().__init__(player_ais[0], num_decks=num_decks,
+            shuffle_deck_at=shuffle_deck_at, quiet=True, log_file=log_file,
+            rng=rng, rules=rules)
+
+        # Every card shown this round goes in revealed, and each seat is
+        # given the ones it hasn't seen yet before it makes a decision, so
+        # every AI is treated as batch_view (see PlayerAI.view_cards).
+        self.batch_view = True
+
+    def sit(self, seat):
+        self.seat = seat
+        self.player_ai = seat.player_ai
+
+    def build_deck(self):
+        self.shoe.shuffle()
+        for seat in self.seats:
+            seat.player_ai.deck_shuffled(self.shoe)
+
+    def flush_revealed(self):
+        # Gives the seat that's playing the cards shown since its last turn.
+        seat = self.seat
+        if seat.seen < len(self.revealed):
+            seat.player_ai.view_cards(bytes(self.revealed[seat.seen:]))
+            seat.seen = len(self.revealed)
+
+    def play_run(self):
+        if self.needs_shuffle():
+            self.build_deck()
+
+        funds = [seat.player_ai.funds for seat in self.seats]
+        true_counts = [getattr(seat.player_ai, "true_count", 0)
+            for seat in self.seats]
+        results = self.play_round()
+
+        for seat, (bet, _, _, outcomes), start_funds, true_count in zip(
+                self.seats, results, funds, true_counts):
+            self.sit(seat)
+            self.flush_revealed()
+            seat.player_ai.end_round(sum(outcomes))
+            seat.seen = 0
+
+            net = seat.player_ai.funds - start_funds
+            seat.rounds.add(net)
+            if seat.stats is not None:
+                seat.stats.add(net, true_count, bet)
+        self.revealed.clear()
+
+    def play_round(self):
+        # Plays a round at every seat. Returns each seat's bet, insurance
+        # bet, whether it surrendered, and the outcome of each of its hands.
+        verbose = self.verbose
+        seats = self.seats
+
+        dealer = main.Hand("Dealer")
+        hands = []
+        for seat in seats:
+            hand = main.Hand(seat.name)
+            seat.player_ai.start_round(hand, dealer)
+            hands.append(hand)
+
+        #Players place their bets.
+        for seat, hand in zip(seats, hands):
+            self.sit(seat)
+            self.flush_revealed()
+            hand.bet = seat.player_ai.make_bet()
+        results = [[hand.bet, 0, False, None] for hand in hands]
+
+        #Deal 2 cards to each seat and the dealer, going round the table.
+        for hand in hands:
+            self.deal(hand, True)
+        self.deal(dealer, True)
+        for hand in hands:
+            self.deal(hand, True)
+        self.deal(dealer, False)
+
+        if dealer[0].base_value == 11:
+            #Players can choose to make an insurance bet.
+            for seat, hand, result in zip(seats, hands, results):
+                self.sit(seat)
+                if verbose:
+                    self.print_hands(hand, dealer)
+                self.flush_revealed()
+                if seat.player_ai.choose_insurance() and self.rules.insurance_bet:
+                    if verbose:
+                        self.print(f"{seat.name} makes an insurance bet.")
+                    result[1] = self.rules.insurance_bet
+
+        #Check for Blackjack
+        if dealer.total == 21:
+            if verbose:
+                self.print("Dealer Blackjack")
+            self.show_card(dealer[1])
+            for seat, hand, result in zip(seats, hands, results):
+                insurance = result[1]
+                if hand.total == 21:
+                    seat.player_ai.funds += 2 * insurance
+                    result[3] = [0]
+                else:
+                    seat.player_ai.funds += 2 * insurance - hand.bet
+                    result[3] = [-1]
+                seat.player_ai.end_hand(hand)
+                if verbose:
+                    self.print_hands(hand, dealer, hide=())
+            return results
+
+        played = []
+        for seat, hand, result in zip(seats, hands, results):
+            self.sit(seat)
+            player_ai = seat.player_ai
+            player_ai.funds -= result[1]
+
+            if hand.total == 21:
+                if verbose:
+                    self.print(f"{seat.name} Blackjack, {seat.name} Wins")
+                pays, per = self.rules.blackjack_pays
+                player_ai.funds += hand.bet * pays // per
+                player_ai.end_hand(hand)
+                result[3] = [+1]
+                continue
+
+            #Player plays out their hand.
+            if verbose:
+                self.print_hands(hand, dealer)
+            self.flush_revealed()
+            if player_ai.choose_surrender() and self.rules.surrender:
+                if verbose:
+                    self.print(f"{seat.name} surrenders")
+                player_ai.funds -= hand.bet // 2
+                player_ai.end_hand(hand)
+                result[2] = True
+                result[3] = [-1]
+                continue
+
+            played.append((seat, hand, result, self.play_hand(hand, dealer)))
+
+        #The dealer plays once for everyone, if anyone is left to beat.
+        if any(h.total <= 21 for _, _, _, seat_hands in played for h in seat_hands):
+            self.resolve_dealer(dealer)
+        else:
+            self.show_card(dealer[1])
+        if verbose:
+            self.print(f"Dealer Total: {dealer.total}")
+
+        for seat, hand, result, seat_hands in played:
+            result[3] = self.settle_seat(seat, hand, dealer, seat_hands)
+        return results
+
+    def settle_seat(self, seat, player, dealer, results):
+        # Pays out a seat's hands against the dealer's finished hand, like
+        # BlackjackSimulator.settle. Returns their outcomes.
+        player_ai = seat.player_ai
+        outcomes = []
+        for hand in results:
+            if hand.total > 21:
+                player_ai.funds -= player.bet
+                outcomes.append(-1)
+            elif dealer.total > 21 or hand.total > dealer.total:
+                player_ai.funds += hand.bet
+                outcomes.append(+1)
+            elif hand.total < dealer.total:
+                player_ai.funds -= hand.bet
+                outcomes.append(-1)
+            else:
+                outcomes.append(0)
+            if self.verbose:
+                self.print_hands(hand, dealer, hide=())
+                self.print(f"{hand.name}: {('Loss', 'Draw', 'Win')[outcomes[-1] + 1]}")
+        return outcomes
+
+    def report(self):
+        lines = [f"{'Seat':8} {'AI':26} {'Wins':>9} {'Losses':>9} {'Draws':>9}"
+            f" {'Profit':>14}   EV per round (95% CI)"]
+        for seat in self.seats:
+            ai = seat.player_ai
+            lines.append(f"{seat.name:8} {type(ai).__name__:26} {ai.wins:>9}"
+                f" {ai.losses:>9} {ai.draws:>9} {ai.funds:>+14.0f}"
+                f"   {seat.rounds.mean:+.3f} ± {seat.rounds.error:.3f}")
+        return lines
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("seats", metavar="AI", nargs="+",
+        help=f"the AI at each seat, from the dealer's left: {', '.join(main.AI_TYPES)}",
+        choices=main.AI_TYPES)
+    parser.add_argument("-n", "--num-rounds",
+        help="set the number of rounds to play (default 100000)",
+        dest="num_rounds", metavar="NUM",
+        type=int, default=100000)
+    parser.add_argument("-d", "--num-decks",
+        help="set the number of decks to play with (default 6)",
+        dest="num_decks", metavar="NUM",
+        type=int, default=6)
+    parser.add_argument("-sh", "--shuffle-at",
+        help="sets the fraction of the cards that are dealt before shuffling (default 0.5)",
+        dest="shuffle_at", metavar="FRAC",
+        type=float, default=0.5)
+    parser.add_argument("-l", "--log", metavar="FILE",
+        help="save the rounds to a file",
+        nargs="?", const="log.txt")
+    parser.add_argument("--house-rules", metavar="CHANGES",
+        help="change the house rules, e.g. hit_soft_17=1,blackjack_pays=6:5"
+            " (see main.HouseRules for all of them)",
+        dest="house_rules", default="default")
+    parser.add_argument("--stats",
+        help="show statistics on each seat's profit per round at the end",
+        action="store_true")
+    parser.add_argument("--seed",
+        help="seed the shuffles",
+        type=int)
+    args = parser.parse_args()
+
+    try:
+        rules = main.HouseRules.parse(args.house_rules)
+    except ValueError as e:
+        parser.error(f"--house-rules: {e}")
+    if len(args.seats) > MAX_SEATS:
+        parser.error(f"a table has at most {MAX_SEATS} seats")
+    if args.num_decks * 52 * args.shuffle_at < 12 * (len(args.seats) + 1):
+        parser.error("not enough cards left at the shuffle point for a round at this table")
+
+    log_file = open(args.log, "w", encoding="utf-8") if args.log else None
+    sim = TableSimulator([main.AI_TYPES[name]() for name in args.seats],
+        num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+        log_file=log_file, rng=main.make_rng(args.seed), stats=args.stats,
+        rules=rules)
+
+    start = time.perf_counter()
+    for _ in range(args.num_rounds):
+        if sim.verbose:
+            sim.print("----------------------------------")
+        sim.play_run()
+    elapsed = time.perf_counter() - start
+
+    print(*sim.report(), sep="\n")
+    if args.stats:
+        for seat in sim.seats:
+            print("----------------------------------")
+            print(f"{seat.name} ({type(seat.player_ai).__name__}):")
+            print(*seat.stats.report(), sep="\n")
+    print(f"({args.num_rounds / elapsed:.0f} rounds/s,"
+        f" {args.num_rounds * len(sim.seats) / elapsed:.0f} seat-rounds/s)")
+
+    if log_file:
+        log_file.close()
@@ -0,0 +1,157 @@
+import main
+
+#Plays every round under several sets of house rules at once, to see what
+#each rule is worth to an AI.
+#Run it with `python variants.py hit_soft_17=1 blackjack_pays=6:5`, see
+#`python variants.py --help` for options.
+#
+#Each variant is a list of changes to the default rules, as taken by
+#main.HouseRules.parse (e.g. `max_splits=3,double_after_split=0`), and the
+#default rules are always played as the first variant.
+#
+#A round is played under the first variant with its rules behind a
+#main.RuleProbe, which notes the rules the round actually read: insurance
+#only comes up with an Ace showing, the blackjack payout on a player
+#blackjack, hit_soft_17 when the dealer gets to soft 17, and so on. Every
+#variant that agrees with it on those rules would have played the round the
+#same way, so they share its result. The round is played again, from the
+#same AI state and the same point in the shoe, for the first variant left
+#over, and so on until every variant has a result. Most rounds differ on no
+#rule at all, so they're played once however many variants there are.
+#
+#The AI and the shoe carry on from the first variant's play, so all the
+#variants play every round from the same count and the same cards. The
+#difference between a variant and the default rules is taken round by
+#round, which gives it a much narrower confidence interval than separate
+#runs would.
+
+class VariantSimulator(main.BlackjackSimulator):
+    def __init__(self, player_ai, variants, num_decks=1, shuffle_deck_at=0.5,
+            rng=None, shoe=None):
+        # variants: a list of HouseRules, played against the first one.
+        super().__init__(player_ai, num_decks=num_decks,
+            shuffle_deck_at=shuffle_deck_at, quiet=True, rng=rng, shoe=shoe,
+            rules=variants[0])
+        self.variants = variants
+        # For each variant, the profit per round, the difference from the
+        # first variant's, and the number of rounds played for it (as
+        # opposed to shared with another variant).
+        self.rounds = [main.RunningStats() for _ in variants]
+        self.differences = [main.RunningStats() for _ in variants]
+        self.played = [0] * len(variants)
+
+    def play_variant(self, v):
+        # Plays the round under variant v from the AI's current state.
+        # Returns the AI's profit and the names of the rules read.
+        player_ai = self.player_ai
+        self.rules = probe = main.RuleProbe(self.variants[v])
+        funds = player_ai.funds
+        _, _, _, outcomes = self.play_round()
+        if self.revealed:
+            self.flush_revealed()
+        player_ai.end_round(sum(outcomes))
+        self.played[v] += 1
+        return player_ai.funds - funds, probe.read
+
+    def play_run(self):
+        if self.needs_shuffle():
+            self.build_deck()
+
+        player_ai = self.player_ai
+        shoe = self.shoe
+        variants = self.variants
+        profits = [None] * len(variants)
+
+        state, dealt = player_ai.save_state(), shoe.dealt
+        end = None
+        left = list(range(len(variants)))
+        while left:
+            profit, read = self.play_variant(left[0])
+            rules = variants[left[0]]
+            for w in left:
+                if all(getattr(variants[w], name) == getattr(rules, name)
+                        for name in read):
+                    profits[w] = profit
+            left = [w for w in left if profits[w] is None]
+
+            if left:
+                if end is None:
+                    end = player_ai.save_state(), shoe.dealt
+                player_ai.restore_state(state)
+                shoe.dealt = dealt
+
+        # Carry on from the first variant's play.
+        if end is not None:
+            player_ai.restore_state(end[0])
+            shoe.dealt = end[1]
+        self.rules = variants[0]
+
+        for v, profit in enumerate(profits):
+            self.rounds[v].add(profit)
+            self.differences[v].add(profit - profits[0])
+
+    def report(self):
+        n = self.rounds[0].n
+        lines = [f"{'Rules':45} {'EV per round (95% CI)':>24}"
+            f" {'Difference (95% CI)':>24} {'Played':>7}"]
+        for rules, stats, difference, played in zip(
+                self.variants, self.rounds, self.differences, self.played):
+            ev = f"{stats.mean:+.3f} ± {stats.error:.3f}"
+            if difference is self.differences[0]:
+                difference = ""
+            else:
+                difference = f"{difference.mean:+.3f} ± {difference.error:.3f}"
+            lines.append(f"{str(rules):45} {ev:>24} {difference:>24}"
+                f" {played / n:>7.1%}")
+        return lines
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("variants", metavar="CHANGES", nargs="+",
+        help="a variant of the house rules, e.g. hit_soft_17=1,blackjack_pays=6:5"
+            " (see main.HouseRules for all of them)")
+    parser.add_argument("-a", "--ai",
+        help=f"the AI to play (default counting): {', '.join(main.AI_TYPES)}",
+        choices=main.AI_TYPES, default="counting")
+    parser.add_argument("-n", "--num-rounds",
+        help="set the number of rounds to play (default 100000)",
+        dest="num_rounds", metavar="NUM",
+        type=int, default=100000)
+    parser.add_argument("-d", "--num-decks",
+        help="set the number of decks to play with (default 1)",
+        dest="num_decks", metavar="NUM",
+        type=int, default=1)
+    parser.add_argument("-sh", "--shuffle-at",
+        help="sets the fraction of the cards that are dealt before shuffling (default 0.5)",
+        dest="shuffle_at", metavar="FRAC",
+        type=float, default=0.5)
+    parser.add_argument("--seed",
+        help="seed the shuffles",
+        type=int)
+    args = parser.parse_args()
+
+    variants = [main.HouseRules()]
+    for changes in args.variants:
+        try:
+            rules = main.HouseRules.parse(changes)
+        except ValueError as e:
+            parser.error(f"{changes}: {e}")
+        if rules not in variants:
+            variants.append(rules)
+
+    sim = VariantSimulator(main.AI_TYPES[args.ai](), variants,
+        num_decks=args.num_decks, shuffle_deck_at=args.shuffle_at,
+        rng=main.make_rng(args.seed))
+
+    start = time.perf_counter()
+    for _ in range(args.num_rounds):
+        sim.play_run()
+    elapsed = time.perf_counter() - start
+
+    print(*sim.report(), sep="\n")
+    print(f"({args.num_rounds / elapsed:.0f} rounds/s, {sum(sim.played) / args.num_rounds:.2f}"
+        f" plays per round for {len(variants)} variants)")